@@ -1,87 +1,745 @@
-from flask import Flask, jsonify, request
-import requests
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from datetime import datetime
-import logging
-
-app = Flask(__name__)
-
-# External API URL for subfeddits
-SUBFEDDIT_API_URL = "http://192.168.1.39:8080/api/v1/comments"
-
-# Helper function to analyze sentiment using VADER
-def analyze_sentiment_vader(text):
-    analyzer = SentimentIntensityAnalyzer()
-    compound_score = analyzer.polarity_scores(text)["compound"]
-    return compound_score
-
-# Helper function to convert user-provided time to timestamp
-def convert_to_timestamp(user_time):
-    try:
-        # Assuming user-provided time is in a general format, like "2023-01-01T00:00:00"
-        dt = datetime.strptime(user_time, "%Y-%m-%dT%H:%M:%S")
-        timestamp = int(dt.timestamp())
-        return timestamp
-    except ValueError as err:
-        logging.error(err)
-        return None
-
-# API route to get recent comments for a given subfeddit
-@app.route("/api/v1/subfeddit/<subfeddit_id>/comments/sentiment", methods=["GET"])
-def get_subfeddit_comments(subfeddit_id):
-    limit = int(request.args.get('limit', 25))
-    skip = int(request.args.get('skip', 0))
-    sort = request.args.get('sort', "asc")
-    start_time = request.args.get('start_time')
-    end_time = request.args.get('end_time')
-
-    subfeddit_params = {
-        "subfeddit_id": subfeddit_id,
-        "skip": skip,
-        "limit": limit,
-    }
-
-    # Fetch subfeddit data from the external API
-    subfeddit_response = requests.request("GET", SUBFEDDIT_API_URL, params=subfeddit_params)
-
-    if subfeddit_response.status_code == 200:
-        subfeddit_data = subfeddit_response.json()
-        comments = subfeddit_data.get("comments", [])
-        result = []
-
-        # Convert user-provided times to timestamps
-        if start_time:
-            start_timestamp = convert_to_timestamp(start_time)
-            if start_timestamp is not None:
-                comments = [comment for comment in comments if start_timestamp <= comment["created_at"]]
-
-        if end_time:
-            end_timestamp = convert_to_timestamp(end_time)
-            if end_timestamp is not None:
-                comments = [comment for comment in comments if comment["created_at"] <= end_timestamp]
-
-        for comment in comments:
-            polarity_score = analyze_sentiment_vader(comment["text"])
-            classification = "positive" if polarity_score > 0 else "negative"
-
-            result.append(
-                {
-                    "id": comment["id"],
-                    "text": comment["text"],
-                    "polarity_score": polarity_score,
-                    "classification": classification,
-                }
-            )
-
-        # Sort comments by polarity score
-        asc = sort != "asc"
-        sorted_result = sorted(result, key=lambda x: x['polarity_score'], reverse=asc)
-        sorted_comments = sorted_result[skip: skip + limit]
-
-        return jsonify(sorted_comments)
-
-    return jsonify({"error": "Subfeddit not found"}), 404
-
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.ERROR)
-    app.run(debug=True)
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+import requests
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from datetime import datetime
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import codecs
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import profiling
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
+app = Flask(__name__)
+
+# External API URL for subfeddits
+SUBFEDDIT_API_URL = "http://192.168.1.39:8080/api/v1/comments"
+UPSTREAM_TIMEOUT = 10
+STREAM_CHUNK_SIZE = 64 * 1024
+GZIP_MIN_SIZE = 1024
+COMMENT_MIRROR = os.getenv("COMMENT_MIRROR", "true").lower() == "true"
+# Order in which the upstream API pages comments: "newest_first", "oldest_first"
+# or "auto" to detect it from the created_at values of the pages
+MIRROR_UPSTREAM_ORDER = os.getenv("MIRROR_UPSTREAM_ORDER", "auto")
+MIRROR_PAGE_SIZE = int(os.getenv("MIRROR_PAGE_SIZE", "500"))
+MIRROR_MAX_PAGES = int(os.getenv("MIRROR_MAX_PAGES", "20"))
+MIRROR_MAX_COMMENTS = int(os.getenv("MIRROR_MAX_COMMENTS", "50000"))
+MIRROR_SYNC_INTERVAL = float(os.getenv("MIRROR_SYNC_INTERVAL", "5"))
+MIRROR_MAX_SUBFEDDITS = int(os.getenv("MIRROR_MAX_SUBFEDDITS", "256"))
+SSE_POLL_INTERVAL = float(os.getenv("SSE_POLL_INTERVAL", "5"))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_SUBSCRIBER_QUEUE = int(os.getenv("SSE_SUBSCRIBER_QUEUE", "256"))
+# Streams hold a worker thread for their whole life, keep this below the
+# worker's thread count so regular requests are still served
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "4"))
+
+# The VADER lexicon is loaded once instead of on every scored comment
+analyzer = SentimentIntensityAnalyzer()
+
+
+# Compact record for an upstream comment, only the fields we use are kept
+class Comment:
+    __slots__ = ("id", "text", "created_at", "polarity_score")
+
+    def __init__(self, id, text, created_at, polarity_score=None):
+        self.id = id
+        self.text = text
+        self.created_at = created_at
+        self.polarity_score = polarity_score
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "text": self.text,
+            "polarity_score": self.polarity_score,
+            "classification": "positive" if self.polarity_score > 0 else "negative",
+        }
+
+
+# Helper function to analyze sentiment using VADER
+def analyze_sentiment_vader(text):
+    with profiling.span("scoring"):
+        compound_score = analyzer.polarity_scores(text)["compound"]
+    return compound_score
+
+
+NUMBER_CONTINUATION = frozenset("0123456789.eE+-")
+
+
+# Incrementally decodes the "comments" array of an upstream page from raw
+# byte chunks, yielding one Comment at a time without materializing the page
+def iter_comments(chunks):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    state = {"buf": "", "pos": 0, "eof": False}
+
+    def fill():
+        chunk = next(chunks, None)
+        if chunk is None:
+            state["buf"] = state["buf"][state["pos"]:] + utf8.decode(b"", final=True)
+            state["eof"] = True
+        else:
+            state["buf"] = state["buf"][state["pos"]:] + utf8.decode(chunk)
+        state["pos"] = 0
+
+    def peek():
+        while True:
+            buf, pos = state["buf"], state["pos"]
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            state["pos"] = pos
+            if pos < len(buf):
+                return buf[pos]
+            if state["eof"]:
+                raise ValueError("Unexpected end of upstream response")
+            fill()
+
+    def expect(char):
+        if peek() != char:
+            raise ValueError("Expected %r in upstream response" % char)
+        state["pos"] += 1
+
+    def value():
+        peek()
+        while True:
+            try:
+                result, end = decoder.raw_decode(state["buf"], state["pos"])
+                # a value is only complete once the character after it is
+                # buffered and cannot continue it, numbers like "1." or "1e"
+                # decode as their integer prefix when split across chunks
+                if state["eof"] or (
+                    end < len(state["buf"]) and state["buf"][end] not in NUMBER_CONTINUATION
+                ):
+                    state["pos"] = end
+                    return result
+            except ValueError:
+                if state["eof"]:
+                    raise
+            fill()
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = value()
+        expect(":")
+        if key != "comments":
+            value()
+        else:
+            expect("[")
+            if peek() == "]":
+                state["pos"] += 1
+            else:
+                while True:
+                    comment = value()
+                    yield Comment(comment["id"], comment["text"], comment["created_at"])
+                    if peek() == "]":
+                        state["pos"] += 1
+                        break
+                    expect(",")
+        if peek() == "}":
+            return
+        expect(",")
+
+
+# Helper function to serialize a response body, gzipped when large and accepted
+def json_response(payload):
+    with profiling.span("serialization"):
+        body = orjson.dumps(payload) if orjson else json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    response = Response(body, mimetype="application/json")
+    if len(body) >= GZIP_MIN_SIZE and "gzip" in request.headers.get("Accept-Encoding", ""):
+        with profiling.span("gzip"):
+            response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+# Helper function to fetch one page of comments from the external API,
+# returns None when the subfeddit does not exist upstream and raises on
+# any other upstream error
+def fetch_comments(subfeddit_id, skip, limit):
+    params = {"subfeddit_id": subfeddit_id, "skip": skip, "limit": limit}
+    with profiling.span("upstream"), requests.get(
+        SUBFEDDIT_API_URL, params=params, stream=True, timeout=UPSTREAM_TIMEOUT
+    ) as response:
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return list(iter_comments(response.iter_content(STREAM_CHUNK_SIZE)))
+
+
+# Local copy of a subfeddit's comments kept in created_at order. Time ranges
+# within a page are narrowed by binary search over the timestamps.
+#
+# The upstream API only pages by position, so every sync anchors on comment ids
+# it already holds instead of trusting positions: a page that should overlap
+# the mirror but shares no id with it means upstream positions moved, and the
+# sync steps back until it finds mirrored comments again. The mirror always
+# holds a contiguous slice of upstream history; has_oldest/has_newest record
+# whether that slice reaches the start of history and the latest sync, and
+# page() answers an upstream page only when the slice holds all its positions.
+#
+# Requests and pollers only call refresh(), which fetches at most one page of
+# the newest comments. Filling the rest of the history runs in a background
+# thread, MIRROR_MAX_PAGES pages per sync. Only one sync runs at a time and
+# upstream I/O happens outside the data lock, concurrent readers answer from
+# what is already mirrored.
+class CommentMirror:
+    def __init__(self, subfeddit_id):
+        self.subfeddit_id = subfeddit_id
+        self.timestamps = []
+        self.comments = []
+        self.ids = set()
+        self.order = None if MIRROR_UPSTREAM_ORDER == "auto" else MIRROR_UPSTREAM_ORDER
+        self.has_oldest = False
+        self.has_newest = False
+        self.trimmed = False
+        self.exists = None
+        # upstream position after the mirrored slice, in upstream order
+        self.next_skip = 0
+        self.last_sync = 0.0
+        self.pages_left = 0
+        self.backfilling = False
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+
+    @property
+    def high_water(self):
+        return self.timestamps[-1] if self.timestamps else None
+
+    def complete(self):
+        return self.has_newest and (self.has_oldest or self.trimmed)
+
+    def add(self, comments):
+        with self.lock:
+            for comment in sorted(comments, key=lambda comment: comment.created_at):
+                if comment.id in self.ids:
+                    continue
+                self.ids.add(comment.id)
+                if not self.timestamps or comment.created_at >= self.timestamps[-1]:
+                    self.timestamps.append(comment.created_at)
+                    self.comments.append(comment)
+                else:
+                    index = bisect_right(self.timestamps, comment.created_at)
+                    self.timestamps.insert(index, comment.created_at)
+                    self.comments.insert(index, comment)
+            excess = len(self.comments) - MIRROR_MAX_COMMENTS
+            if excess > 0:
+                for comment in self.comments[:excess]:
+                    self.ids.discard(comment.id)
+                del self.timestamps[:excess]
+                del self.comments[:excess]
+                self.has_oldest = False
+                self.trimmed = True
+
+    def reset(self):
+        with self.lock:
+            self.timestamps, self.comments, self.ids = [], [], set()
+            self.has_oldest = self.has_newest = self.trimmed = False
+            self.next_skip = 0
+
+    def range(self, start_timestamp=None, end_timestamp=None):
+        low = 0 if start_timestamp is None else bisect_left(self.timestamps, start_timestamp)
+        high = len(self.timestamps) if end_timestamp is None else bisect_right(self.timestamps, end_timestamp)
+        return self.comments[low:high]
+
+    # Comments of the upstream page skip/limit within the time range, in
+    # upstream order, or None when the mirrored slice does not hold every
+    # position of that page
+    def page(self, skip, limit, start_timestamp=None, end_timestamp=None):
+        count = len(self.comments)
+        if self.order == "newest_first":
+            if not self.has_newest or (skip + limit > count and not self.has_oldest):
+                return None
+            low, high = count - skip - limit, count - skip
+        elif self.order == "oldest_first":
+            if not self.has_oldest or (skip + limit > count and not self.has_newest):
+                return None
+            low, high = skip, skip + limit
+        else:
+            return None
+        low, high = max(low, 0), min(high, count)
+        if start_timestamp is not None:
+            low = max(low, bisect_left(self.timestamps, start_timestamp))
+        if end_timestamp is not None:
+            high = min(high, bisect_right(self.timestamps, end_timestamp))
+        if low >= high:
+            return []
+        if self.order == "newest_first":
+            return self.comments[high - 1:low - 1 if low else None:-1]
+        return self.comments[low:high]
+
+    def fetch(self, skip):
+        if self.pages_left <= 0:
+            return None
+        self.pages_left -= 1
+        page = fetch_comments(self.subfeddit_id, skip, MIRROR_PAGE_SIZE)
+        if page is None:
+            if self.exists is None:
+                self.exists = False
+            raise LookupError("Subfeddit %s not found upstream" % self.subfeddit_id)
+        self.exists = True
+        if self.order is None and len({comment.created_at for comment in page}) > 1:
+            self.order = "newest_first" if page[0].created_at > page[-1].created_at else "oldest_first"
+        return page
+
+    def known(self, page):
+        return any(comment.id in self.ids for comment in page)
+
+    # Pages from position 0 until the end of history or the page budget
+    def sync_from_start(self):
+        self.reset()
+        skip = 0
+        while True:
+            page = self.fetch(skip)
+            if page is None:
+                return
+            self.add(page)
+            skip += len(page)
+            self.next_skip = skip
+            if len(page) < MIRROR_PAGE_SIZE:
+                self.has_oldest = not self.trimmed
+                self.has_newest = True
+                return
+            # position 0 is one end of history, kept if a later page fails
+            self.has_newest = self.order == "newest_first"
+            self.has_oldest = self.order == "oldest_first" and not self.trimmed
+
+    # Newest first: new comments are at the front, page until mirrored ones,
+    # then continue backfilling older history after the mirrored slice
+    def sync_newest_first(self):
+        self.has_newest = False
+        skip = new = 0
+        while True:
+            page = self.fetch(skip)
+            if page is None:
+                # more new comments than the page budget, the slice would have a gap
+                logging.warning("Comment mirror of subfeddit %s fell behind, resyncing", self.subfeddit_id)
+                self.reset()
+                return
+            reached_mirrored = self.known(page)
+            new += sum(1 for comment in page if comment.id not in self.ids)
+            self.add(page)
+            skip += len(page)
+            if reached_mirrored or len(page) < MIRROR_PAGE_SIZE:
+                break
+        self.has_newest = True
+        if len(page) < MIRROR_PAGE_SIZE:
+            self.has_oldest = not self.trimmed
+        if self.has_oldest or self.trimmed:
+            return
+        self.next_skip = max(self.next_skip + new, skip)
+        self.extend_tail()
+
+    # Oldest first: new comments are at the end, continue after the mirrored slice
+    def sync_oldest_first(self):
+        self.has_newest = False
+        self.extend_tail()
+
+    # Continues paging after the mirrored slice with one comment of overlap,
+    # stepping back until the first page overlaps the mirror
+    def extend_tail(self):
+        skip = max(0, self.next_skip - 1)
+        anchored = False
+        while True:
+            page = self.fetch(skip)
+            if page is None:
+                return
+            if not anchored and skip > 0 and not self.known(page):
+                skip = max(0, skip - MIRROR_PAGE_SIZE)
+                continue
+            anchored = True
+            self.add(page)
+            skip += len(page)
+            self.next_skip = skip
+            if len(page) < MIRROR_PAGE_SIZE:
+                if self.order == "newest_first":
+                    self.has_oldest = not self.trimmed
+                else:
+                    self.has_newest = True
+                return
+
+    # One page of newest comments; when they do not reach the mirrored ones
+    # the slice would have a gap, so catching up is left to the backfill
+    def refresh_newest_first(self):
+        page = self.fetch(0)
+        if not self.known(page) and len(page) == MIRROR_PAGE_SIZE:
+            self.has_newest = False
+            return
+        new = sum(1 for comment in page if comment.id not in self.ids)
+        self.add(page)
+        self.next_skip += new
+        self.has_newest = True
+        if len(page) < MIRROR_PAGE_SIZE:
+            self.has_oldest = not self.trimmed
+
+    # Request path sync: at most one upstream page, and only once the mirror
+    # holds the newest comments. Anything more is handed to backfill().
+    # Returns False only when the subfeddit does not exist upstream.
+    def refresh(self):
+        if time.monotonic() - self.last_sync < MIRROR_SYNC_INTERVAL:
+            return self.exists is not False
+        if not self.sync_lock.acquire(blocking=False):
+            return self.exists is not False
+        try:
+            if self.ids and self.order is not None and (self.has_newest or self.order == "oldest_first"):
+                self.pages_left = 1
+                if self.order == "newest_first":
+                    self.refresh_newest_first()
+                else:
+                    self.sync_oldest_first()
+                self.last_sync = time.monotonic()
+        except (requests.RequestException, ValueError, LookupError) as err:
+            logging.warning("Refreshing comments of subfeddit %s failed: %s", self.subfeddit_id, err)
+            self.last_sync = time.monotonic()
+        finally:
+            self.sync_lock.release()
+        if self.exists is not False and not self.complete():
+            self.schedule_backfill()
+        return self.exists is not False
+
+    # Up to MIRROR_MAX_PAGES pages towards a complete mirror, returns False
+    # when the sync failed
+    def sync(self):
+        with self.sync_lock:
+            self.pages_left = MIRROR_MAX_PAGES
+            try:
+                if not self.ids or self.order is None:
+                    self.sync_from_start()
+                elif self.order == "newest_first":
+                    self.sync_newest_first()
+                else:
+                    self.sync_oldest_first()
+            except (requests.RequestException, ValueError, LookupError) as err:
+                logging.warning("Syncing comments of subfeddit %s failed: %s", self.subfeddit_id, err)
+                return False
+            finally:
+                self.last_sync = time.monotonic()
+        return True
+
+    def schedule_backfill(self):
+        with self.lock:
+            if self.backfilling:
+                return
+            self.backfilling = True
+        threading.Thread(
+            target=self.backfill, name="mirror-backfill-%s" % self.subfeddit_id, daemon=True
+        ).start()
+
+    # Syncs every MIRROR_SYNC_INTERVAL until the mirror is complete, stopping
+    # early on upstream errors or a sync that mirrored nothing new; the next
+    # refresh() starts it again
+    def backfill(self):
+        try:
+            while True:
+                mirrored = len(self.ids)
+                if not self.sync() or self.complete() or len(self.ids) == mirrored:
+                    return
+                time.sleep(MIRROR_SYNC_INTERVAL)
+        finally:
+            with self.lock:
+                self.backfilling = False
+
+
+comment_mirrors = OrderedDict()
+comment_mirrors_lock = threading.Lock()
+
+
+# Helper function returning the mirror of a subfeddit, least recently used
+# mirrors are dropped once MIRROR_MAX_SUBFEDDITS is exceeded
+def get_comment_mirror(subfeddit_id):
+    with comment_mirrors_lock:
+        mirror = comment_mirrors.pop(subfeddit_id, None) or CommentMirror(subfeddit_id)
+        comment_mirrors[subfeddit_id] = mirror
+        while len(comment_mirrors) > MIRROR_MAX_SUBFEDDITS:
+            comment_mirrors.popitem(last=False)
+    return mirror
+
+
+# Helper function returning the scored comments of upstream page skip/limit
+# within a time range from the mirror, or None when the mirror cannot answer
+# that page and upstream must
+def mirrored_comments(subfeddit_id, skip, limit, start_timestamp, end_timestamp):
+    mirror = get_comment_mirror(subfeddit_id)
+    if not mirror.refresh():
+        return None
+    with mirror.lock:
+        comments = mirror.page(skip, limit, start_timestamp, end_timestamp)
+    for comment in comments or ():
+        if comment.polarity_score is None:
+            comment.polarity_score = analyze_sentiment_vader(comment.text)
+    return comments
+
+
+# Queue of server-sent events for one connected client. When a slow client
+# lets the queue fill up the oldest events are dropped and the client is told
+# how many it missed, so it never holds back the poller or other clients.
+class Subscriber:
+    def __init__(self):
+        self.events = queue.Queue(maxsize=SSE_SUBSCRIBER_QUEUE)
+        self.dropped = 0
+
+    def publish(self, event):
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+# One background poller per subfeddit syncs the mirror, scores new comments
+# once and fans them out to every subscriber. It stops with its last subscriber.
+class SubfedditPoller:
+    def __init__(self, subfeddit_id):
+        self.subfeddit_id = subfeddit_id
+        self.subscribers = set()
+        self.cursor = None
+        self.cursor_ids = set()
+        self.thread = None
+
+    def poll_once(self):
+        mirror = get_comment_mirror(self.subfeddit_id)
+        if not mirror.refresh():
+            return None
+        with mirror.lock:
+            if not mirror.has_newest:
+                # still backfilling, comments added now are not necessarily new
+                return []
+            if self.cursor is None:
+                # new subscribers only receive comments arriving from now on
+                self.cursor = mirror.high_water if mirror.high_water is not None else float("-inf")
+                self.cursor_ids = {c.id for c in mirror.range(self.cursor, self.cursor)}
+                return []
+            new_comments = [
+                comment
+                for comment in mirror.range(self.cursor, None)
+                if comment.created_at > self.cursor or comment.id not in self.cursor_ids
+            ]
+        for comment in new_comments:
+            if comment.polarity_score is None:
+                comment.polarity_score = analyze_sentiment_vader(comment.text)
+            if comment.created_at != self.cursor:
+                self.cursor = comment.created_at
+                self.cursor_ids = set()
+            self.cursor_ids.add(comment.id)
+        return new_comments
+
+    def run(self):
+        while True:
+            try:
+                new_comments = self.poll_once()
+            except Exception as err:
+                logging.error("Polling subfeddit %s failed: %s", self.subfeddit_id, err)
+                new_comments = []
+            with sse_pollers_lock:
+                subscribers = list(self.subscribers)
+                if not subscribers or new_comments is None:
+                    sse_pollers.pop(self.subfeddit_id, None)
+            for subscriber in subscribers:
+                if new_comments is None:
+                    subscriber.publish(None)
+                for comment in new_comments or ():
+                    subscriber.publish(comment.to_dict())
+            if not subscribers or new_comments is None:
+                return
+            time.sleep(SSE_POLL_INTERVAL)
+
+
+sse_pollers = {}
+sse_pollers_lock = threading.Lock()
+sse_subscriber_count = 0
+
+
+# Returns (None, None) when the worker already streams SSE_MAX_SUBSCRIBERS clients
+def subscribe(subfeddit_id):
+    global sse_subscriber_count
+    subscriber = Subscriber()
+    with sse_pollers_lock:
+        if sse_subscriber_count >= SSE_MAX_SUBSCRIBERS:
+            return None, None
+        sse_subscriber_count += 1
+        poller = sse_pollers.get(subfeddit_id)
+        if poller is None:
+            poller = sse_pollers[subfeddit_id] = SubfedditPoller(subfeddit_id)
+            poller.thread = threading.Thread(
+                target=poller.run, name="sse-poller-%s" % subfeddit_id, daemon=True
+            )
+            poller.thread.start()
+        poller.subscribers.add(subscriber)
+    return poller, subscriber
+
+
+def unsubscribe(poller, subscriber):
+    global sse_subscriber_count
+    with sse_pollers_lock:
+        if subscriber in poller.subscribers:
+            poller.subscribers.discard(subscriber)
+            sse_subscriber_count -= 1
+
+
+# Helper function to convert user-provided time to timestamp
+def convert_to_timestamp(user_time):
+    try:
+        # Assuming user-provided time is in a general format, like "2023-01-01T00:00:00"
+        dt = datetime.strptime(user_time, "%Y-%m-%dT%H:%M:%S")
+        timestamp = int(dt.timestamp())
+        return timestamp
+    except ValueError as err:
+        logging.error(err)
+        return None
+
+# Start profiling the request when profiling is enabled and it is selected
+@app.before_request
+def start_profile():
+    mode = profiling.profile_mode(request.headers.get(profiling.PROFILE_HEADER))
+    if mode is None:
+        return
+    profile = profiling.start("%s %s" % (request.method, request.path))
+    if profile is None:
+        return
+    # the worker thread serves only this request until teardown
+    profile.add_thread()
+    g.profile, g.profile_mode = profile, mode
+    g.profile_token = profiling.current_profile.set(profile)
+
+
+# Finish the request profile and save it or return it as an attachment
+@app.after_request
+def finish_profile(response):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    profiling.current_profile.reset(g.pop("profile_token"))
+    profile.stop()
+    if g.pop("profile_mode") == "attach":
+        # the original response is never sent, close it so its close
+        # callbacks (e.g. releasing a live stream) still run
+        response.close()
+        return Response(
+            profile.to_json(),
+            mimetype="application/json",
+            headers=profiling.attachment_headers(profile, response.status_code),
+        )
+    logging.info("Saved request profile to %s", profile.save())
+    response.headers["X-Profile-Id"] = profile.id
+    return response
+
+
+# Stop a profile left running by a request that failed before after_request
+@app.teardown_request
+def discard_profile(error=None):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profiling.current_profile.reset(g.pop("profile_token"))
+        profile.stop()
+
+
+# API route to get recent comments for a given subfeddit
+@app.route("/api/v1/subfeddit/<subfeddit_id>/comments/sentiment", methods=["GET"])
+def get_subfeddit_comments(subfeddit_id):
+    limit = int(request.args.get('limit', 25))
+    skip = int(request.args.get('skip', 0))
+    sort = request.args.get('sort', "asc")
+    start_time = request.args.get('start_time')
+    end_time = request.args.get('end_time')
+
+    subfeddit_params = {
+        "subfeddit_id": subfeddit_id,
+        "skip": skip,
+        "limit": limit,
+    }
+
+    # Convert user-provided times to timestamps
+    start_timestamp = convert_to_timestamp(start_time) if start_time else None
+    end_timestamp = convert_to_timestamp(end_time) if end_time else None
+
+    # Time-range queries are answered from the local mirror when it holds
+    # the whole upstream page, which only fetches the newest comments from
+    # upstream. Pages the mirror does not hold yet go to upstream directly.
+    result = None
+    if COMMENT_MIRROR and (start_timestamp is not None or end_timestamp is not None):
+        result = mirrored_comments(subfeddit_id, skip, limit, start_timestamp, end_timestamp)
+    if result is not None:
+        result = list(result)
+    else:
+        # Stream subfeddit data from the external API, filtering and scoring in one pass.
+        # The upstream span covers the request up to the response headers, reading
+        # the body is interleaved with the scoring spans.
+        with profiling.span("upstream"):
+            subfeddit_response = requests.get(
+                SUBFEDDIT_API_URL, params=subfeddit_params, stream=True, timeout=UPSTREAM_TIMEOUT
+            )
+        with subfeddit_response:
+            if subfeddit_response.status_code != 200:
+                return jsonify({"error": "Subfeddit not found"}), 404
+
+            result = []
+            for comment in iter_comments(subfeddit_response.iter_content(STREAM_CHUNK_SIZE)):
+                if start_timestamp is not None and comment.created_at < start_timestamp:
+                    continue
+                if end_timestamp is not None and comment.created_at > end_timestamp:
+                    continue
+                comment.polarity_score = analyze_sentiment_vader(comment.text)
+                result.append(comment)
+
+    # Sort comments by polarity score
+    asc = sort != "asc"
+    result.sort(key=lambda comment: comment.polarity_score, reverse=asc)
+    sorted_comments = [comment.to_dict() for comment in result[skip: skip + limit]]
+
+    return json_response(sorted_comments)
+
+# API route streaming scored comments of a subfeddit as server-sent events
+@app.route("/api/v1/subfeddit/<subfeddit_id>/comments/sentiment/stream", methods=["GET"])
+def stream_subfeddit_comments(subfeddit_id):
+    poller, subscriber = subscribe(subfeddit_id)
+    if subscriber is None:
+        response = jsonify({"error": "Too many live streams, retry later"})
+        response.headers["Retry-After"] = str(int(SSE_POLL_INTERVAL))
+        return response, 503
+
+    def events():
+        yield "retry: %d\n\n" % int(SSE_POLL_INTERVAL * 1000)
+        while True:
+            try:
+                event = subscriber.events.get(timeout=SSE_HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            if subscriber.dropped:
+                yield "event: lagged\ndata: %d\n\n" % subscriber.dropped
+                subscriber.dropped = 0
+            if event is None:
+                yield 'event: error\ndata: {"error": "Subfeddit not found"}\n\n'
+                return
+            yield "event: comment\ndata: %s\n\n" % json.dumps(event)
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # runs when the stream ends or the client disconnects, and also when the
+    # response is closed before it was ever iterated
+    response.call_on_close(lambda: unsubscribe(poller, subscriber))
+    return response
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    app.run(debug=True)
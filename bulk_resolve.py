@@ -0,0 +1,214 @@
+"""Command line tool resolving golden AMI IDs for a whole inventory offline
+
+The golden AMI and KR card tables are loaded once with a segmented
+parallel Scan and every inventory row is resolved in memory with the same
+selection rules as RetrieveAMI.retreive_golden_ami, so a fleet-wide
+campaign costs a single pass over each table instead of one /get_ami call
+per row.
+
+Usage:
+    python bulk_resolve.py inventory.csv --output resolved.jsonl
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from concurrent import futures
+
+import boto3
+
+INVENTORY_FIELDS = ("kr_card", "os_type", "ami_flavour", "region", "account_id", "imds_ver")
+GOLDEN_AMI_ATTRIBUTES = (
+    "AMIID",
+    "ExpiryDate",
+    "BaseAMIID",
+    "AMIFlavour",
+    "Platform",
+    "IMDSVersion",
+    "EC2Account",
+    "EC2Region",
+    "AMIActive",
+)
+KR_CARD_ATTRIBUTES = ("KR_CARD", "BaseAMIID")
+
+
+def parallel_scan(client, table_name: str, attributes: tuple, segments: int) -> list:
+    """Read a whole table with a segmented parallel Scan
+
+    Args:
+        client: boto3 DynamoDB client
+        table_name (str): table to scan
+        attributes (tuple): attribute names to project
+        segments (int): number of scan segments read concurrently
+
+    Returns:
+        list: raw DynamoDB items
+    """
+
+    def scan_segment(segment: int) -> list:
+        paginator = client.get_paginator("scan")
+        items = []
+        for page in paginator.paginate(
+            TableName=table_name,
+            Segment=segment,
+            TotalSegments=segments,
+            ProjectionExpression=",".join("#a%d" % i for i in range(len(attributes))),
+            ExpressionAttributeNames={"#a%d" % i: name for i, name in enumerate(attributes)},
+        ):
+            items.extend(page["Items"])
+        return items
+
+    logging.info("Scanning %s with %d segments", table_name, segments)
+    with futures.ThreadPoolExecutor(max_workers=segments) as executor:
+        results = executor.map(scan_segment, range(segments))
+        return [item for items in results for item in items]
+
+
+def build_indexes(golden_items: list) -> tuple:
+    """Index active golden AMIs by the keys retreive_golden_ami queries on
+
+    Only the item with the highest ExpiryDate is kept per key, matching the
+    first item of a ScanIndexForward=False query on the ExpiryDate indexes.
+
+    Args:
+        golden_items (list): raw items of the golden AMI table
+
+    Returns:
+        tuple: (by_flavour, by_base_ami) dicts of key -> (AMIID, ExpiryDate, BaseAMIID)
+    """
+    by_flavour = {}
+    by_base_ami = {}
+    for item in golden_items:
+        if not item.get("AMIActive", {}).get("BOOL"):
+            continue
+        try:
+            filters = (
+                item["AMIFlavour"]["S"],
+                item["Platform"]["S"],
+                item["IMDSVersion"]["S"],
+                item["EC2Account"]["S"],
+                item["EC2Region"]["S"],
+            )
+            resolved = (item["AMIID"]["S"], int(item["ExpiryDate"]["N"]), item["BaseAMIID"]["S"])
+        except KeyError:
+            continue
+        for index, key in ((by_flavour, filters), (by_base_ami, (resolved[2],) + filters)):
+            if key not in index or index[key][1] < resolved[1]:
+                index[key] = resolved
+    return by_flavour, by_base_ami
+
+
+def resolve_row(row: dict, kr_cards: dict, by_flavour: dict, by_base_ami: dict) -> dict:
+    """Resolve one inventory row
+
+    KR cards pinned to a base AMI only resolve within that base AMI. Unpinned
+    KR cards resolve by flavour and are pinned to the resolved base AMI in
+    kr_cards, as the service does by writing the KR card table.
+
+    Args:
+        row (dict): inventory row keyed by INVENTORY_FIELDS
+        kr_cards (dict): KR card -> base ami id, updated in place
+        by_flavour (dict): flavour index from build_indexes
+        by_base_ami (dict): base ami index from build_indexes
+
+    Returns:
+        dict: row with ami_id, expiry_date and status added
+    """
+    filters = (row["ami_flavour"], row["os_type"], row["imds_ver"], row["account_id"], row["region"])
+    base_ami_id = kr_cards.get(row["kr_card"])
+    if base_ami_id:
+        resolved = by_base_ami.get((base_ami_id,) + filters)
+    else:
+        resolved = by_flavour.get(filters)
+        if resolved:
+            kr_cards[row["kr_card"]] = resolved[2]
+    if resolved is None:
+        return dict(row, ami_id=None, expiry_date=None, status="not_found")
+    return dict(row, ami_id=resolved[0], expiry_date=resolved[1], status="ok")
+
+
+def read_inventory(path: str):
+    """Yield inventory rows from a CSV or JSONL file, '-' reads stdin"""
+    handle = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        if path.endswith(".jsonl") or path.endswith(".json"):
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(handle)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inventory", help="CSV or JSONL file with %s" % ", ".join(INVENTORY_FIELDS))
+    parser.add_argument("--output", default="-", help="output file, default stdout")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    parser.add_argument("--segments", type=int, default=8, help="parallel scan segments")
+    parser.add_argument("--golden-ami-table", default=os.getenv("GOLDEN_AMI_TABLE"))
+    parser.add_argument("--kr-card-table", default=os.getenv("KR_CARD_TABLE"))
+    parser.add_argument("--table-region", default=os.getenv("REGION"))
+    parser.add_argument(
+        "--update-kr-table",
+        action="store_true",
+        help="persist new KR card pins like the service does",
+    )
+    args = parser.parse_args(argv)
+    if not args.golden_ami_table:
+        parser.error("--golden-ami-table or GOLDEN_AMI_TABLE is required")
+    if not args.kr_card_table:
+        parser.error("--kr-card-table or KR_CARD_TABLE is required")
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    client = boto3.client("dynamodb", region_name=args.table_region)
+    by_flavour, by_base_ami = build_indexes(
+        parallel_scan(client, args.golden_ami_table, GOLDEN_AMI_ATTRIBUTES, args.segments)
+    )
+    kr_cards = {
+        item["KR_CARD"]["S"]: item["BaseAMIID"]["S"]
+        for item in parallel_scan(client, args.kr_card_table, KR_CARD_ATTRIBUTES, args.segments)
+        if "BaseAMIID" in item
+    }
+    pinned = set(kr_cards)
+    new_pins = {}
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    writer = None
+    counts = {"ok": 0, "not_found": 0}
+    try:
+        for row in read_inventory(args.inventory):
+            result = resolve_row(row, kr_cards, by_flavour, by_base_ami)
+            counts[result["status"]] += 1
+            if result["status"] == "ok" and row["kr_card"] not in pinned:
+                new_pins.setdefault(row["kr_card"], result["ami_id"])
+            if args.format == "csv":
+                if writer is None:
+                    writer = csv.DictWriter(output, fieldnames=list(result))
+                    writer.writeheader()
+                writer.writerow(result)
+            else:
+                output.write(json.dumps(result) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.update_kr_table:
+        table = boto3.resource("dynamodb", region_name=args.table_region).Table(args.kr_card_table)
+        with table.batch_writer() as batch:
+            for kr_card, ami_id in new_pins.items():
+                batch.put_item(
+                    Item={"KR_CARD": kr_card, "BaseAMIID": kr_cards[kr_card], "AMIID": ami_id}
+                )
+        logging.info("Pinned %d KR cards in %s", len(new_pins), args.kr_card_table)
+    logging.info("Resolved %d rows, %d without a matching ami", counts["ok"], counts["not_found"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,25 +7,598 @@ Returns:
 """
 
 import os
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
 import time
 import sys
+import contextvars
+import hashlib
+import threading
+from collections import Counter, deque
+from concurrent import futures
+from typing import Optional
 import boto3
 import botocore
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+
+import profiling
+
+try:
+    import redis
+except ImportError:  # optional, only needed for AMI_CACHE_BACKEND=redis
+    redis = None
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE_LIMIT = int(os.getenv("LOG_SAMPLE_LIMIT", "10"))
+LOG_SAMPLE_INTERVAL = float(os.getenv("LOG_SAMPLE_INTERVAL", "1.0"))
+LOG_DEBUG_RESPONSES = os.getenv("LOG_DEBUG_RESPONSES", "false").lower() == "true"
+HEDGE_READS = os.getenv("HEDGE_READS", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "10"))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("HEDGE_DEFAULT_DELAY_MS", "50"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "32"))
+HEDGE_REPLICA_REGION = os.getenv("HEDGE_REPLICA_REGION")
+AMI_CACHE_BACKEND = os.getenv("AMI_CACHE_BACKEND", "memory")
+AMI_CACHE_URL = os.getenv("AMI_CACHE_URL", "redis://localhost:6379/0")
+AMI_CACHE_MAX_ENTRIES = int(os.getenv("AMI_CACHE_MAX_ENTRIES", "10000"))
+AMI_STALE_TTL = int(os.getenv("AMI_STALE_TTL", "86400"))
+KR_CARD_CACHE_TTL = int(os.getenv("KR_CARD_CACHE_TTL", "60"))
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "10"))
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", "5"))
+BREAKER_ERROR_THRESHOLD = float(os.getenv("BREAKER_ERROR_THRESHOLD", "0.5"))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", "20"))
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "30"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "15"))
+DEGRADED_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingException",
+    "InternalServerError",
+    "ServiceUnavailable",
+}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats log records as single line JSON documents"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "func": record.funcName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            document["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            document["exc_info"] = record.exc_text
+        return json.dumps(document, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Rate limits records below WARNING per message template
+
+    At most `limit` records sharing the same unformatted message are let
+    through in every `interval` seconds, warnings and errors always pass.
+    Windows older than `interval` are pruned and at most `max_windows` are
+    tracked, so pre-formatted messages cannot grow the table without bound.
+    """
+
+    def __init__(self, limit: int, interval: float, max_windows: int = 1024):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.max_windows = max_windows
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.limit <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            window_start, count = self.windows.pop(record.msg, (now, 0))
+            if now - window_start >= self.interval:
+                window_start, count = now, 0
+            if len(self.windows) >= self.max_windows:
+                self.windows = {
+                    msg: window
+                    for msg, window in self.windows.items()
+                    if now - window[0] < self.interval
+                }
+                while len(self.windows) >= self.max_windows:
+                    self.windows.pop(next(iter(self.windows)))
+            self.windows[record.msg] = (window_start, count + 1)
+        return count < self.limit
+
+
+IMMUTABLE_LOG_ARG_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread
+
+    Only records whose args are all immutable are deferred. Other records
+    are rendered on the calling thread, as QueueHandler.prepare does, because
+    mutable args may change before the listener formats them and tracebacks
+    would keep request frames alive until then.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if not record.exc_info and (
+            not args
+            or isinstance(args, tuple)
+            and all(isinstance(arg, IMMUTABLE_LOG_ARG_TYPES) for arg in args)
+        ):
+            return record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
 
 root = logging.getLogger()
 if root.handlers:
     for handler in root.handlers:
         root.removeHandler(handler)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)-15s - %(funcName)s - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
-)
+stream_handler = logging.StreamHandler(sys.stdout)
+if LOG_FORMAT == "json":
+    stream_handler.setFormatter(StructuredFormatter())
+else:
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)-15s - %(funcName)s - %(levelname)s - %(message)s")
+    )
+log_queue = queue.SimpleQueue()
+queue_handler = DeferredQueueHandler(log_queue)
+queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_LIMIT, LOG_SAMPLE_INTERVAL))
+logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler])
+log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+log_listener.start()
+atexit.register(lambda: log_listener.stop())
+
+
+def restart_log_listener() -> None:
+    """Start a fresh listener thread in forked workers, threads do not survive fork"""
+    global log_listener
+    log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    log_listener.start()
+
+
+os.register_at_fork(after_in_child=restart_log_listener)
 logger = logging.getLogger()
 
 
+class LatencyTracker:
+    """Keeps a sliding window of read latencies for percentile lookups"""
+
+    def __init__(self, size: int = 1000, min_samples: int = 20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self.lock:
+            self.samples.append(latency)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Return the pct percentile of the window, None until warmed up"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+
+class HedgedReader:
+    """Issues a second identical DynamoDB read when the first one is slow
+
+    The hedge fires once the primary has been executing longer than the
+    HEDGE_PERCENTILE latency of recent reads; time spent queued for a pool
+    thread does not count, and no hedge is sent while every pool thread is
+    busy, since it would only queue behind the same backlog. Every read earns HEDGE_BUDGET
+    tokens and every hedge spends one, so hedges never add more than that
+    fraction of extra load. Hedges go to HEDGE_REPLICA_REGION when it points
+    at a replica of a global table, otherwise to the primary region.
+    """
+
+    def __init__(self):
+        self.enabled = HEDGE_READS
+        self.tracker = LatencyTracker()
+        self.executor = None
+        self.hedge_clients = {}
+        self.tokens = 0.0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.stats = {
+            "reads": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "budget_exhausted": 0,
+            "pool_saturated": 0,
+        }
+
+    def _hedge_client(self, region: str):
+        with self.lock:
+            if region not in self.hedge_clients:
+                self.hedge_clients[region] = boto3.client("dynamodb", region_name=region)
+            return self.hedge_clients[region]
+
+    def _take_token(self) -> bool:
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.stats["hedges"] += 1
+                return True
+            self.stats["budget_exhausted"] += 1
+            return False
+
+    def _timed(self, client, operation: str, kwargs: dict, track: bool, started=None):
+        if started is not None:
+            started.set()
+        start = time.monotonic()
+        try:
+            with profiling.span("hedged.%s" % ("primary" if track else "hedge")):
+                result = getattr(client, operation)(**kwargs)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        if track:
+            self.tracker.record(time.monotonic() - start)
+        return result
+
+    def _submit(self, client, operation: str, kwargs: dict, track: bool, started=None):
+        with self.lock:
+            self.in_flight += 1
+        # run in a copy of the caller's context so the request profile sees the read
+        return self.executor.submit(
+            contextvars.copy_context().run, self._timed, client, operation, kwargs, track, started
+        )
+
+    def read(self, client, operation: str, **kwargs) -> dict:
+        """Run a read operation on client, hedging it when enabled
+
+        Args:
+            client: boto3 DynamoDB client for the primary region
+            operation (str): client method name, e.g. "get_item" or "query"
+
+        Returns:
+            dict: response of whichever request completed first
+        """
+        if not self.enabled:
+            return getattr(client, operation)(**kwargs)
+        with self.lock:
+            if self.executor is None:
+                self.executor = futures.ThreadPoolExecutor(
+                    max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge"
+                )
+            self.stats["reads"] += 1
+            self.tokens = min(self.tokens + HEDGE_BUDGET, 10.0)
+        delay = self.tracker.percentile(HEDGE_PERCENTILE)
+        delay = max(
+            HEDGE_MIN_DELAY_MS / 1000,
+            delay if delay is not None else HEDGE_DEFAULT_DELAY_MS / 1000,
+        )
+        started = threading.Event()
+        primary = self._submit(client, operation, kwargs, True, started)
+        started.wait()
+        try:
+            return primary.result(timeout=delay)
+        except futures.TimeoutError:
+            pass
+        with self.lock:
+            saturated = self.in_flight >= HEDGE_MAX_WORKERS
+            if saturated:
+                self.stats["pool_saturated"] += 1
+        if saturated or not self._take_token():
+            return primary.result()
+        hedge_client = self._hedge_client(HEDGE_REPLICA_REGION or client.meta.region_name)
+        hedge = self._submit(hedge_client, operation, kwargs, False)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self.lock:
+                            self.stats["hedge_wins"] += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+
+hedged_reader = HedgedReader()
+
+
+class CircuitOpenError(Exception):
+    """Raised when a read is rejected because its circuit is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__("circuit %s is open" % name)
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Error-rate circuit breaker guarding reads against one table or index
+
+    The breaker opens once at least BREAKER_MIN_REQUESTS reads were seen in
+    the last BREAKER_WINDOW seconds and the share of degraded errors among
+    them reaches BREAKER_ERROR_THRESHOLD. After BREAKER_COOLDOWN seconds a
+    single half-open probe is let through; its outcome closes or reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.outcomes = deque()
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> None:
+        """Admit a read or raise CircuitOpenError"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + BREAKER_COOLDOWN - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return
+            raise CircuitOpenError(self.name, max(remaining, 1.0))
+
+    def record(self, failed: bool) -> None:
+        """Record the outcome of an admitted read"""
+        now = time.monotonic()
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+                self.outcomes.clear()
+                if failed:
+                    self._trip(now)
+                else:
+                    self.state = self.CLOSED
+                    logging.warning("Circuit %s closed", self.name)
+                return
+            self.outcomes.append((now, failed))
+            while self.outcomes and self.outcomes[0][0] < now - BREAKER_WINDOW:
+                self.outcomes.popleft()
+            failures = sum(1 for _, outcome in self.outcomes if outcome)
+            if (
+                self.state == self.CLOSED
+                and len(self.outcomes) >= BREAKER_MIN_REQUESTS
+                and failures / len(self.outcomes) >= BREAKER_ERROR_THRESHOLD
+            ):
+                self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self.state = self.OPEN
+        self.opened_at = now
+        self.outcomes.clear()
+        logging.error("Circuit %s opened", self.name)
+
+
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
+
+
+def is_degraded_error(exc: Exception) -> bool:
+    """Whether an exception signals a degraded table rather than a bad request"""
+    if isinstance(exc, botocore.exceptions.ClientError):
+        return exc.response.get("Error", {}).get("Code") in DEGRADED_ERROR_CODES
+    return isinstance(
+        exc, (botocore.exceptions.HTTPClientError, botocore.exceptions.ConnectionError)
+    )
+
+
+def guarded_read(client, operation: str, **kwargs) -> dict:
+    """Run a DynamoDB read through the circuit breaker of its table/index
+
+    Args:
+        client: boto3 DynamoDB client
+        operation (str): client method name, e.g. "get_item" or "query"
+
+    Raises:
+        CircuitOpenError: the circuit for the table/index is open
+
+    Returns:
+        dict: DynamoDB response
+    """
+    name = "/".join(filter(None, (kwargs.get("TableName"), kwargs.get("IndexName"))))
+    with circuit_breakers_lock:
+        breaker = circuit_breakers.setdefault(name, CircuitBreaker(name))
+    breaker.allow()
+    try:
+        with profiling.span("dynamodb.%s %s" % (operation, name)):
+            response = hedged_reader.read(client, operation, **kwargs)
+    except Exception as exc:
+        breaker.record(is_degraded_error(exc))
+        raise
+    breaker.record(False)
+    return response
+
+
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed, at admission or when its retry budget runs out"""
+
+    def __init__(self, retry_after: float, reason: str = "admission queue is full"):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def retry_backoff() -> None:
+    """Sleep before retrying a throttled DynamoDB call
+
+    Raises:
+        OverloadedError: the backoff would overrun the request deadline
+    """
+    deadline = request_deadline.get()
+    if deadline is not None and time.monotonic() + RETRY_BACKOFF >= deadline:
+        logging.warning("Retry budget exhausted, shedding request")
+        raise OverloadedError(RETRY_BACKOFF, "retry budget exhausted")
+    time.sleep(RETRY_BACKOFF)
+
+
+class AdmissionController:
+    """Concurrency limiter with a bounded wait queue
+
+    At most max_concurrency requests resolve against DynamoDB at once and at
+    most max_queue more wait for a slot. Requests beyond that, or waiting
+    past their timeout, are rejected with OverloadedError.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+        self.stats = {"admitted": 0, "shed": 0}
+
+    def acquire(self, timeout: float) -> None:
+        with self.condition:
+            if self.active < self.max_concurrency and not self.waiting:
+                self.active += 1
+                self.stats["admitted"] += 1
+                return
+            if self.waiting >= self.max_queue:
+                self.stats["shed"] += 1
+                raise OverloadedError(1.0)
+            self.waiting += 1
+            try:
+                admitted = self.condition.wait_for(
+                    lambda: self.active < self.max_concurrency, timeout
+                )
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.stats["shed"] += 1
+                raise OverloadedError(max(timeout, 1.0))
+            self.active += 1
+            self.stats["admitted"] += 1
+
+    def release(self) -> None:
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+
+admission = AdmissionController(ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE)
+
+
+class InProcessCache:
+    """Thread safe in-process cache backend with per key TTL"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key: str, value, ttl: int) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+            if len(self.entries) >= self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+            self.entries[key] = (time.monotonic() + ttl, value)
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class RedisCache:
+    """Cache backend shared by all workers through a Redis compatible server
+
+    Values are stored as JSON with the same TTL semantics as InProcessCache.
+    Errors talking to the server are logged and treated as cache misses so
+    the lookup falls back to DynamoDB.
+    """
+
+    def __init__(self, url: str, prefix: str = "golden-ami:"):
+        if redis is None:
+            raise RuntimeError("AMI_CACHE_BACKEND=redis requires the redis package")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05)
+        self.prefix = prefix
+
+    def get(self, key: str):
+        try:
+            value = self.client.get(self.prefix + key)
+        except redis.RedisError as err:
+            logging.warning("Cache get failed for %s: %s", key, err)
+            return None
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value, ttl: int) -> None:
+        if ttl <= 0:
+            # already expired, matching InProcessCache which never returns it
+            self.delete(key)
+            return
+        try:
+            self.client.set(self.prefix + key, json.dumps(value), px=max(1, int(ttl * 1000)))
+        except redis.RedisError as err:
+            logging.warning("Cache set failed for %s: %s", key, err)
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.delete(self.prefix + key)
+        except redis.RedisError as err:
+            logging.warning("Cache delete failed for %s: %s", key, err)
+
+
+def create_cache():
+    """Build the cache backend selected by AMI_CACHE_BACKEND"""
+    if AMI_CACHE_BACKEND == "redis":
+        return RedisCache(AMI_CACHE_URL)
+    if AMI_CACHE_BACKEND == "memory":
+        return InProcessCache(AMI_CACHE_MAX_ENTRIES)
+    raise ValueError("Unknown AMI_CACHE_BACKEND %s" % AMI_CACHE_BACKEND)
+
+
+ami_cache = create_cache()
+
+
+def kr_card_cache_key(table_name: str, kr_card: str) -> str:
+    return "kr:%s:%s" % (table_name, kr_card)
+
+
+def resolved_ami_cache_key(params: tuple) -> str:
+    return "ami:" + "|".join(params)
+
+
 class RetrieveAMI:
     """A class implementation to encapsulate the logic for retrieving AMIID"""
 
@@ -47,12 +620,21 @@ class RetrieveAMI:
             str: base ami id used in lower environment
         """
         logging.info("Retreiving base ami based on KR card %s", kr_card)
+        cache_key = kr_card_cache_key(table_name, kr_card)
+        base_ami_id = ami_cache.get(cache_key)
+        if base_ami_id:
+            return base_ami_id
         dynamodb_client = boto3.client("dynamodb", region_name=RetrieveAMI.region)
         try:
-            response = dynamodb_client.get_item(
-                TableName=table_name, Key={"KR_CARD": {"S": kr_card}}
+            response = guarded_read(
+                dynamodb_client,
+                "get_item",
+                TableName=table_name,
+                Key={"KR_CARD": {"S": kr_card}},
             )
-            return response["Item"]["BaseAMIID"]["S"]
+            base_ami_id = response["Item"]["BaseAMIID"]["S"]
+            ami_cache.set(cache_key, base_ami_id, KR_CARD_CACHE_TTL)
+            return base_ami_id
         except botocore.exceptions.NoCredentialsError as err:
             logging.error("Unable to locate credentials")
             raise HTTPException(
@@ -67,8 +649,8 @@ class RetrieveAMI:
                 kr_card,
                 exc,
             )
-            time.sleep(5)
-            return RetrieveAMI.get_base_ami(kr_card)
+            retry_backoff()
+            return RetrieveAMI.get_base_ami(table_name, kr_card)
         except dynamodb_client.exceptions.RequestLimitExceeded as exc:
             logging.warning(
                 "Request limit exceeded getting item from %s for KR_CARD: %s with error: %s",
@@ -76,8 +658,8 @@ class RetrieveAMI:
                 kr_card,
                 exc,
             )
-            time.sleep(5)
-            return RetrieveAMI.get_base_ami(kr_card)
+            retry_backoff()
+            return RetrieveAMI.get_base_ami(table_name, kr_card)
         except KeyError:
             logging.info("KR card %s is not avialble in database", kr_card)
             return False
@@ -88,6 +670,8 @@ class RetrieveAMI:
             raise HTTPException(
                 status_code=500, detail="Internal server error"
             ) from err
+        except (CircuitOpenError, OverloadedError):
+            raise
         except Exception as e:
             logging.error(
                 "error occured while retrieving base ami from KR Card Table: %s", e
@@ -124,6 +708,7 @@ class RetrieveAMI:
                 ReturnConsumedCapacity="TOTAL",
                 TableName=table_name,
             )
+            ami_cache.delete(kr_card_cache_key(table_name, kr_card))
             return True
         except (
             dynamodb_client.exceptions.ProvisionedThroughputExceededException
@@ -134,8 +719,8 @@ class RetrieveAMI:
                 kr_card,
                 exc,
             )
-            time.sleep(5)
-            return dynamodb_client.update_kr_table(ami_id, kr_card, base_ami_id)
+            retry_backoff()
+            return RetrieveAMI.update_kr_table(table_name, ami_id, kr_card, base_ami_id)
         except dynamodb_client.exceptions.RequestLimitExceeded as exc:
             logging.warning(
                 "Request limit exceeded putting item for %s for KR_CARD: %s with error: %s",
@@ -143,8 +728,8 @@ class RetrieveAMI:
                 kr_card,
                 exc,
             )
-            time.sleep(5)
-            return RetrieveAMI.update_kr_table(ami_id, kr_card, base_ami_id)
+            retry_backoff()
+            return RetrieveAMI.update_kr_table(table_name, ami_id, kr_card, base_ami_id)
         except Exception as err:
             logging.error(
                 "error occured: %s while updating %s with entries %s, %s, %s",
@@ -161,6 +746,26 @@ class RetrieveAMI:
     ) -> str:
         """instance method for retrieving golden ami id based on params
 
+        Args:
+            kr_card (str): KR card number provided in query parameter
+            platform (str): Type of operating system
+            ami_flavour (str): Flavour of AMI provieded in query parameter
+            region (str): Region in AWS account
+            account_id (str): AWS Account ID
+            imds_version (str): IMDS version
+
+        Returns:
+            str: golden ami id
+        """
+        return self.resolve_golden_ami(
+            kr_card, platform, ami_flavour, region, account_id, imds_version
+        )["AMIID"]
+
+    def resolve_golden_ami(
+        self, kr_card, platform, ami_flavour, region, account_id, imds_version
+    ) -> dict:
+        """instance method for resolving the golden ami item based on params
+
         Args:
             kr_card (str): KR card number provided in query parameter
             platform (str): Type of operating system
@@ -174,7 +779,7 @@ class RetrieveAMI:
             HTTPException: 404 Not Found
 
         Returns:
-            str: golden ami id
+            dict: resolved item with AMIID and ExpiryDate
         """
         logging.info(
             "Retreiving golden ami id based on params provided in KR CARD: %s", kr_card
@@ -184,7 +789,9 @@ class RetrieveAMI:
         if not base_ami_id:
             key_filtering_exp = "AMIFlavour = :Flavour"
             try:
-                response = dynamodb_client.query(
+                response = guarded_read(
+                    dynamodb_client,
+                    "query",
                     TableName=self.golden_ami_table,
                     IndexName="AMIFlavour-ExpiryDate-index",
                     Select="SPECIFIC_ATTRIBUTES",
@@ -203,12 +810,16 @@ class RetrieveAMI:
                     ProjectionExpression="AMIID,ExpiryDate,BaseAMIID",
                     ScanIndexForward=False,
                 )
-                print(response)
+                if LOG_DEBUG_RESPONSES:
+                    logging.debug("Query response for KR CARD %s: %s", kr_card, response)
                 base_ami = response["Items"][0]["BaseAMIID"]["S"]
                 golden_ami_id = response["Items"][0]["AMIID"]["S"]
                 if not self.update_kr_table(self.kr_card_table_name, golden_ami_id, kr_card, base_ami):
                     raise HTTPException(status_code=500, detail="Internal server error")
-                return golden_ami_id
+                return {
+                    "AMIID": golden_ami_id,
+                    "ExpiryDate": int(response["Items"][0]["ExpiryDate"]["N"]),
+                }
             except (
                 dynamodb_client.exceptions.ProvisionedThroughputExceededException
             ) as exc:
@@ -217,8 +828,8 @@ class RetrieveAMI:
                     kr_card,
                     exc,
                 )
-                time.sleep(5)
-                return self.retreive_golden_ami(
+                retry_backoff()
+                return self.resolve_golden_ami(
                     kr_card, platform, ami_flavour, region, account_id, imds_version
                 )
             except dynamodb_client.exceptions.RequestLimitExceeded as exc:
@@ -227,8 +838,8 @@ class RetrieveAMI:
                     kr_card,
                     exc,
                 )
-                time.sleep(5)
-                return self.retreive_golden_ami(
+                retry_backoff()
+                return self.resolve_golden_ami(
                     kr_card, platform, ami_flavour, region, account_id, imds_version
                 )
             except dynamodb_client.exceptions.InternalServerError as err:
@@ -261,7 +872,9 @@ class RetrieveAMI:
         else:
             key_filtering_exp = "BaseAMIID = :Base"
             try:
-                response = dynamodb_client.query(
+                response = guarded_read(
+                    dynamodb_client,
+                    "query",
                     TableName=self.golden_ami_table,
                     IndexName="BaseAMIID-ExpiryDate-index",
                     Select="SPECIFIC_ATTRIBUTES",
@@ -283,8 +896,10 @@ class RetrieveAMI:
                     ProjectionExpression="AMIID,ExpiryDate,BaseAMIID",
                     ScanIndexForward=False,
                 )
-                golden_ami_id = response["Items"][0]["AMIID"]["S"]
-                return golden_ami_id
+                return {
+                    "AMIID": response["Items"][0]["AMIID"]["S"],
+                    "ExpiryDate": int(response["Items"][0]["ExpiryDate"]["N"]),
+                }
             except (
                 dynamodb_client.exceptions.ProvisionedThroughputExceededException
             ) as exc:
@@ -293,8 +908,8 @@ class RetrieveAMI:
                     kr_card,
                     exc,
                 )
-                time.sleep(5)
-                return self.retreive_golden_ami(
+                retry_backoff()
+                return self.resolve_golden_ami(
                     kr_card, platform, ami_flavour, region, account_id, imds_version
                 )
             except dynamodb_client.exceptions.RequestLimitExceeded as exc:
@@ -303,8 +918,8 @@ class RetrieveAMI:
                     kr_card,
                     exc,
                 )
-                time.sleep(5)
-                return self.retreive_golden_ami(
+                retry_backoff()
+                return self.resolve_golden_ami(
                     kr_card, platform, ami_flavour, region, account_id, imds_version
                 )
             except dynamodb_client.exceptions.InternalServerError as err:
@@ -336,8 +951,199 @@ class RetrieveAMI:
                 ) from err
 
 
+AMI_CACHE_MAX_AGE = int(os.getenv("AMI_CACHE_MAX_AGE", "300"))
+REFRESH_AHEAD = os.getenv("REFRESH_AHEAD", "true").lower() == "true"
+REFRESH_AHEAD_SECONDS = int(os.getenv("REFRESH_AHEAD_SECONDS", "60"))
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "10"))
+REFRESH_TOP_N = int(os.getenv("REFRESH_TOP_N", "100"))
+
+resolved_ami_hits = Counter()
+resolved_ami_hits_lock = threading.Lock()
+
+
+def ami_etag(ami_id: str) -> str:
+    """Build a strong ETag over the resolved AMI ID
+
+    Args:
+        ami_id (str): golden ami id
+
+    Returns:
+        str: quoted ETag value
+    """
+    return '"%s"' % hashlib.sha256(ami_id.encode("utf-8")).hexdigest()[:32]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag
+
+    Args:
+        if_none_match (str): raw If-None-Match header value
+        etag (str): current ETag of the resource
+
+    Returns:
+        bool: True if the client copy is still current
+    """
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or "W/" + etag in candidates
+
+
+def cache_ttl(entry: dict) -> int:
+    """Seconds a resolved AMI entry stays fresh
+
+    An entry is fresh until the item's ExpiryDate and for at most
+    AMI_CACHE_MAX_AGE after it was resolved, so deactivated AMIs are
+    picked up again.
+
+    Args:
+        entry (dict): resolved item with AMIID, ExpiryDate and ResolvedAt
+
+    Returns:
+        int: remaining freshness in seconds, zero or negative once stale
+    """
+    now = time.time()
+    return int(
+        min(entry["ExpiryDate"] - now, entry["ResolvedAt"] + AMI_CACHE_MAX_AGE - now)
+    )
+
+
+def caching_headers(entry: dict) -> dict:
+    """Build HTTP caching headers for a resolved AMI entry
+
+    Args:
+        entry (dict): resolved item with AMIID, ExpiryDate, ResolvedAt and ETag
+
+    Returns:
+        dict: Cache-Control and ETag headers
+    """
+    max_age = max(0, cache_ttl(entry))
+    return {"Cache-Control": "public, max-age=%d" % max_age, "ETag": entry["ETag"]}
+
+
+def resolve_and_store(params: tuple, refresh_kr_card: bool = False) -> dict:
+    """Resolve a golden ami and swap the result into the local cache
+
+    Args:
+        params (tuple): kr_card, platform, ami_flavour, region, account_id, imds_version
+        refresh_kr_card (bool): drop the cached KR card pin so it is read again
+
+    Returns:
+        dict: cache entry with AMIID, ExpiryDate, ResolvedAt and ETag
+    """
+    if refresh_kr_card:
+        ami_cache.delete(kr_card_cache_key(RetrieveAMI.kr_card_table_name, params[0]))
+    item = RetrieveAMI().resolve_golden_ami(*params)
+    entry = dict(item, ResolvedAt=time.time(), ETag=ami_etag(item["AMIID"]))
+    ami_cache.set(resolved_ami_cache_key(params), entry, AMI_STALE_TTL)
+    return entry
+
+
+class AMIRefresher:
+    """Background thread re-resolving hot cache entries before they go stale
+
+    Every REFRESH_INTERVAL seconds the REFRESH_TOP_N most requested parameter
+    tuples whose entry has less than REFRESH_AHEAD_SECONDS of freshness left
+    are resolved again, bypassing the cached KR card pin. Each refresh gets
+    REQUEST_DEADLINE seconds like a request, so throttling cannot stall the
+    refresher. Hit counts are halved on every pass so popularity follows
+    recent traffic.
+    """
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {"refreshed": 0, "failed": 0}
+
+    def run_once(self) -> None:
+        with resolved_ami_hits_lock:
+            hot = [params for params, _ in resolved_ami_hits.most_common(REFRESH_TOP_N)]
+            for params in list(resolved_ami_hits):
+                resolved_ami_hits[params] //= 2
+                if not resolved_ami_hits[params]:
+                    del resolved_ami_hits[params]
+        for params in hot:
+            entry = ami_cache.get(resolved_ami_cache_key(params))
+            if (
+                entry is None
+                or entry["ExpiryDate"] <= time.time()
+                or cache_ttl(entry) > REFRESH_AHEAD_SECONDS
+            ):
+                continue
+            token = request_deadline.set(time.monotonic() + REQUEST_DEADLINE)
+            try:
+                resolve_and_store(params, refresh_kr_card=True)
+                self.stats["refreshed"] += 1
+            except Exception as err:
+                self.stats["failed"] += 1
+                logging.warning("Refresh ahead failed for KR CARD %s: %s", params[0], err)
+            finally:
+                request_deadline.reset(token)
+
+    def run(self) -> None:
+        while not self.stop_event.wait(REFRESH_INTERVAL):
+            self.run_once()
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name="ami-refresher", daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread = None
+
+
+ami_refresher = AMIRefresher()
+
 app = FastAPI()
 
+
+async def profile_request(request: Request, call_next):
+    """Profile the request when it is selected
+
+    Only registered when PROFILING_ENABLED is set, so requests do not pay
+    for the middleware otherwise. The event loop thread runs every request
+    and is never sampled, the endpoint's threadpool thread and hedged read
+    threads are sampled while they run profiling spans.
+    """
+    mode = profiling.profile_mode(request.headers.get(profiling.PROFILE_HEADER))
+    profile = profiling.start("%s %s" % (request.method, request.url.path)) if mode else None
+    if profile is None:
+        return await call_next(request)
+    token = profiling.current_profile.set(profile)
+    try:
+        response = await call_next(request)
+    finally:
+        profiling.current_profile.reset(token)
+        profile.stop()
+    if mode == "attach":
+        return Response(
+            content=profile.to_json(),
+            media_type="application/json",
+            headers=profiling.attachment_headers(profile, response.status_code),
+        )
+    logging.info("Saved request profile to %s", profile.save())
+    response.headers["X-Profile-Id"] = profile.id
+    return response
+
+
+if profiling.PROFILING_ENABLED:
+    app.middleware("http")(profile_request)
+
+
+@app.on_event("startup")
+def start_refresher():
+    if REFRESH_AHEAD:
+        ami_refresher.start()
+
+
+@app.on_event("shutdown")
+def stop_refresher():
+    ami_refresher.stop()
+
+
 @app.get("/get_ami")
 def get_ami(
     kr_card: str,
@@ -346,6 +1152,8 @@ def get_ami(
     region: str,
     account_id: str,
     imds_ver: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
 ):
     """Endpoint to retrieve golden ami based on provided query parameters
        via GET method
@@ -357,19 +1165,67 @@ def get_ami(
         region (str): Region in AWS account
         account_id (str): AWS Account ID
         imds_version (str): IMDS version
+        if_none_match (str): ETag of a previously returned ami id
+
+    Fresh cached results are served without queueing, everything else
+    goes through the admission controller and gets REQUEST_DEADLINE seconds
+    including throttling retries.
+
+    Raises:
+        HTTPException: 503 when DynamoDB is degraded or the service is
+            overloaded and nothing is cached
 
     Returns:
-        str: golden ami id
+        str: golden ami id, or an empty 304 if the client copy is current.
+            While a circuit is open or the service is overloaded the last
+            known good ami id is served with an X-AMI-Stale header.
     """
-    ami_obj = RetrieveAMI()
-    return ami_obj.retreive_golden_ami(
-        kr_card,
-        os_type,
-        ami_flavour,
-        region,
-        account_id,
-        imds_ver,
-    )
+    params = (kr_card, os_type, ami_flavour, region, account_id, imds_ver)
+    with profiling.span("cache.get"):
+        entry = ami_cache.get(resolved_ami_cache_key(params))
+    if REFRESH_AHEAD:
+        with resolved_ami_hits_lock:
+            resolved_ami_hits[params] += 1
+
+    if entry is None or cache_ttl(entry) <= 0:
+        token = request_deadline.set(time.monotonic() + REQUEST_DEADLINE)
+        try:
+            admission.acquire(min(ADMISSION_QUEUE_TIMEOUT, REQUEST_DEADLINE))
+            try:
+                with profiling.span("resolve"):
+                    entry = resolve_and_store(params)
+            finally:
+                admission.release()
+        except (CircuitOpenError, OverloadedError) as err:
+            if entry is None:
+                logging.error("%s and no previous result for KR CARD: %s", err, kr_card)
+                raise HTTPException(
+                    status_code=503,
+                    detail="Service temporarily unavailable",
+                    headers={"Retry-After": str(int(err.retry_after))},
+                ) from err
+            logging.warning("%s, serving stale ami id for KR CARD: %s", err, kr_card)
+            response.headers["Cache-Control"] = "no-store"
+            response.headers["X-AMI-Stale"] = "true"
+            return entry["AMIID"]
+        finally:
+            request_deadline.reset(token)
+    if etag_matches(if_none_match, entry["ETag"]):
+        return Response(status_code=304, headers=caching_headers(entry))
+    response.headers.update(caching_headers(entry))
+    return entry["AMIID"]
+
+@app.get("/metrics")
+def metrics():
+    """Endpoint exposing in-process counters of the read path"""
+    with circuit_breakers_lock:
+        breakers = {name: breaker.state for name, breaker in circuit_breakers.items()}
+    return {
+        "hedging": dict(hedged_reader.stats),
+        "circuit_breakers": breakers,
+        "refresh_ahead": dict(ami_refresher.stats),
+        "admission": dict(admission.stats),
+    }
 
 @app.get("/healthy")
 def health_check():
@@ -0,0 +1,198 @@
+"""On-demand per-request profiling shared by the FastAPI and Flask services
+
+A request is profiled when PROFILING_ENABLED is set and it either carries
+PROFILE_SECRET in the X-Profile header or is picked by PROFILE_SAMPLE_RATE.
+At most PROFILE_MAX_ACTIVE requests are profiled at a time. A profiled
+request gets timing spans recorded through span() plus a wall-clock sampling
+profile of the threads running those spans, or of threads registered with
+add_thread(). The result is saved under PROFILE_DIR, which keeps the newest
+PROFILE_MAX_FILES profiles, or returned as an attachment instead of the
+normal body with "X-Profile: <secret>; attach". When no profile is active,
+span() costs one context variable lookup.
+"""
+
+import contextlib
+import contextvars
+import glob
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "2"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+PROFILE_HEADER = "X-Profile"
+MAX_SPANS = 1000
+
+active_profiles = threading.BoundedSemaphore(PROFILE_MAX_ACTIVE)
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+NULL_SPAN = contextlib.nullcontext()
+
+
+class RequestProfile:
+    """Sampling profile and timing spans of a single request"""
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        # thread ident -> open registrations, only these threads are sampled
+        self.threads = Counter()
+        self.stacks = Counter()
+        self.spans = []
+        self.span_totals = {}
+        self.started = time.perf_counter()
+        self.duration = None
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self.lock = threading.Lock()
+        # set by start() when the profile took a PROFILE_MAX_ACTIVE slot
+        self.holds_slot = False
+
+    def _sample(self) -> None:
+        while not self.stop_event.wait(PROFILE_INTERVAL):
+            frames = sys._current_frames()
+            with self.lock:
+                idents = list(self.threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, code.co_filename, frame.f_lineno))
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> "RequestProfile":
+        self.sampler.start()
+        return self
+
+    def stop(self) -> None:
+        if self.stop_event.is_set():
+            return
+        self.duration = time.perf_counter() - self.started
+        self.stop_event.set()
+        self.sampler.join()
+        if self.holds_slot:
+            active_profiles.release()
+
+    def add_thread(self) -> None:
+        """Sample the calling thread until the profile stops"""
+        with self.lock:
+            self.threads[threading.get_ident()] += 1
+
+    def _remove_thread(self, ident: int) -> None:
+        with self.lock:
+            self.threads[ident] -= 1
+            if self.threads[ident] <= 0:
+                del self.threads[ident]
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        ident = threading.get_ident()
+        self.add_thread()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._remove_thread(ident)
+            with self.lock:
+                if len(self.spans) < MAX_SPANS:
+                    self.spans.append(
+                        {"name": name, "start": start - self.started, "duration": end - start}
+                    )
+                count, total = self.span_totals.get(name, (0, 0.0))
+                self.span_totals[name] = (count + 1, total + end - start)
+
+    def to_json(self) -> bytes:
+        document = {
+            "id": self.id,
+            "name": self.name,
+            "duration": self.duration,
+            "sample_interval": PROFILE_INTERVAL,
+            "span_totals": {
+                name: {"count": count, "total": total}
+                for name, (count, total) in self.span_totals.items()
+            },
+            "spans": self.spans,
+            # collapsed stacks, ready for flamegraph tooling
+            "samples": dict(self.stacks.most_common()),
+        }
+        return json.dumps(document).encode("utf-8")
+
+    def save(self) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, "profile-%s.json" % self.id)
+        with open(path, "wb") as handle:
+            handle.write(self.to_json())
+        prune_profiles()
+        return path
+
+
+def prune_profiles() -> None:
+    """Delete the oldest saved profiles beyond PROFILE_MAX_FILES"""
+    paths = glob.glob(os.path.join(PROFILE_DIR, "profile-*.json"))
+    if len(paths) <= PROFILE_MAX_FILES:
+        return
+    paths.sort(key=lambda path: os.stat(path).st_mtime if os.path.exists(path) else 0)
+    for path in paths[: len(paths) - PROFILE_MAX_FILES]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def profile_mode(header_value):
+    """How a request with the given X-Profile header value gets profiled
+
+    The header only selects a request when it carries PROFILE_SECRET, as
+    "<secret>" to save the profile or "<secret>; attach" to return it
+    instead of the response. Sampled requests are always saved.
+
+    Returns:
+        "save", "attach" or None when the request is not profiled
+    """
+    if not PROFILING_ENABLED:
+        return None
+    if header_value and PROFILE_SECRET:
+        secret, _, mode = header_value.partition(";")
+        if hmac.compare_digest(secret.strip().encode("utf-8"), PROFILE_SECRET.encode("utf-8")):
+            return "attach" if mode.strip() == "attach" else "save"
+    if random.random() < PROFILE_SAMPLE_RATE:
+        return "save"
+    return None
+
+
+def start(name: str):
+    """Start a request profile, None when PROFILE_MAX_ACTIVE are already running"""
+    if not active_profiles.acquire(blocking=False):
+        return None
+    profile = RequestProfile(name)
+    profile.holds_slot = True
+    return profile.start()
+
+
+def span(name: str):
+    """Time a block as part of the active request profile, if any"""
+    profile = current_profile.get()
+    if profile is None:
+        return NULL_SPAN
+    return profile.span(name)
+
+
+def attachment_headers(profile: RequestProfile, status_code: int) -> dict:
+    return {
+        "Content-Disposition": 'attachment; filename="profile-%s.json"' % profile.id,
+        "X-Profile-Id": profile.id,
+        "X-Profile-Status": str(status_code),
+    }
@@ -0,0 +1,111 @@
+"""Production entry point for the golden AMI and sentiment services
+
+Heavy modules and read-only data (boto3/botocore service models, the
+FastAPI/Flask apps, the VADER lexicon) are loaded once in the gunicorn
+master before workers are forked, so workers share them copy-on-write and
+start warm. Workers are recycled after MAX_REQUESTS requests and a HUP
+signal to the master replaces them gracefully.
+
+The ami service runs on the UvicornWorker of the uvicorn-worker package, the
+sentiment service on gthread workers. Live SSE streams hold a thread each, so
+--threads must stay above the sentiment service's SSE_MAX_SUBSCRIBERS.
+
+Usage:
+    python serve.py ami --workers 4 --bind 0.0.0.0:8000
+    python serve.py sentiment --workers 4 --bind 0.0.0.0:5000
+"""
+
+import argparse
+import gc
+import importlib
+import logging
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+SERVICES = {
+    "ami": {"module": "main", "worker_class": "uvicorn_worker.UvicornWorker"},
+    "sentiment": {"module": "app", "worker_class": "gthread"},
+}
+
+
+def preload(service: str):
+    """Import the service and warm its read-only state in the master
+
+    Args:
+        service (str): key of SERVICES
+
+    Returns:
+        the WSGI/ASGI application object
+    """
+    module = importlib.import_module(SERVICES[service]["module"])
+    if service == "ami":
+        import boto3
+
+        # loads and caches the DynamoDB service model, clients created in
+        # workers through the default session reuse it
+        boto3.client("dynamodb", region_name=module.RetrieveAMI.region)
+    # the sentiment module already loaded the VADER lexicon at import, now
+    # keep preloaded objects out of the collector so workers do not touch
+    # (and copy) their pages during collections
+    gc.collect()
+    gc.freeze()
+    return module.app
+
+
+class PreforkApplication(BaseApplication):
+    """gunicorn application serving an already imported app object"""
+
+    def __init__(self, application, options: dict):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("service", choices=sorted(SERVICES))
+    parser.add_argument("--bind", default=os.getenv("BIND", "0.0.0.0:8000"))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WORKER_THREADS", "8")))
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", "10000")))
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.getenv("MAX_REQUESTS_JITTER", "1000")))
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("WORKER_TIMEOUT", "30")))
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")))
+    args = parser.parse_args(argv)
+
+    logging.info("Preloading %s service", args.service)
+    application = preload(args.service)
+    if args.service == "sentiment":
+        max_streams = importlib.import_module(SERVICES["sentiment"]["module"]).SSE_MAX_SUBSCRIBERS
+        if args.threads <= max_streams:
+            parser.error(
+                "--threads must be greater than SSE_MAX_SUBSCRIBERS (%d) so live streams "
+                "cannot take every worker thread" % max_streams
+            )
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": SERVICES[args.service]["worker_class"],
+        "threads": args.threads if args.service == "sentiment" else None,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests_jitter,
+        "timeout": args.timeout,
+        "graceful_timeout": args.graceful_timeout,
+        "preload_app": True,
+    }
+    PreforkApplication(application, options).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+import gzip
+import json
+import time
+
+import pytest
+
+import app
+
+
+PAGE = {
+    "subfeddit_id": 1,
+    "limit": 1.5,
+    "skip": 2e1,
+    "meta": {"title": "comments", "tags": ["a", {"comments": []}], "active": True, "owner": None},
+    "comments": [
+        {"id": 1, "username": "user_0", "text": "Über gut 👍", "created_at": 1704453378},
+        {"id": 2, "username": "user_1", "text": "not \"great\"", "created_at": -1.25e3},
+    ],
+    "total": 1234567,
+}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", range(1, 40))
+def test_iter_comments_any_chunk_boundary(size):
+    "Test comments decode the same for every chunk size, splitting numbers and unicode"
+    raw = json.dumps(PAGE, ensure_ascii=False).encode("utf-8")
+    comments = list(app.iter_comments(chunked(raw, size)))
+    assert [(c.id, c.text, c.created_at) for c in comments] == [
+        (c["id"], c["text"], c["created_at"]) for c in PAGE["comments"]
+    ]
+
+
+def test_iter_comments_number_split_after_dot():
+    "Test a float split right after its decimal point is not cut short"
+    assert list(app.iter_comments([b'{"limit": 1.', b'5, "comments": []}'])) == []
+    assert list(app.iter_comments([b'{"limit": 1e', b'2, "comments": []}'])) == []
+
+
+def test_iter_comments_empty_and_missing_comments():
+    "Test pages without comments yield nothing"
+    assert list(app.iter_comments([b'{"comments": []}'])) == []
+    assert list(app.iter_comments([b'{"skip": 0, "limit": 25}'])) == []
+    assert list(app.iter_comments([b"{}"])) == []
+
+
+def test_iter_comments_truncated_page():
+    "Test a truncated upstream page raises instead of yielding partial data"
+    with pytest.raises(ValueError):
+        list(app.iter_comments([b'{"comments": [{"id": 1, "text": "a"']))
+
+
+def test_json_response_gzips_large_bodies():
+    "Test large responses are gzipped for clients accepting it"
+    payload = [{"id": i, "text": "comment %d" % i} for i in range(200)]
+    with app.app.test_request_context(headers={"Accept-Encoding": "gzip, deflate"}):
+        response = app.json_response(payload)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(response.get_data())) == payload
+
+
+def test_json_response_small_or_not_accepted():
+    "Test small bodies and clients without gzip get plain JSON"
+    payload = [{"id": i, "text": "comment %d" % i} for i in range(200)]
+    with app.app.test_request_context():
+        response = app.json_response(payload)
+    assert "Content-Encoding" not in response.headers
+    assert json.loads(response.get_data()) == payload
+    with app.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = app.json_response([])
+    assert "Content-Encoding" not in response.headers
+
+
+WORDS = ["good", "bad", "great comment", "terrible", "ok", "love it", "hate it"]
+
+
+class FakeUpstream:
+    "Pages a list of comments by position like the upstream comments API"
+
+    def __init__(self, count, newest_first=True):
+        self.rows = [(i, 1704453378 + i) for i in range(count)]
+        self.newest_first = newest_first
+        self.fail_at = None
+        self.calls = []
+
+    def add(self, count):
+        start = self.rows[-1][0] + 1
+        self.rows += [(i, 1704453378 + i) for i in range(start, start + count)]
+
+    def __call__(self, subfeddit_id, skip, limit):
+        self.calls.append(skip)
+        if self.fail_at is not None and skip >= self.fail_at:
+            raise app.requests.RequestException("upstream unavailable")
+        rows = sorted(self.rows, key=lambda row: row[1], reverse=self.newest_first)
+        return [app.Comment(id, WORDS[id % len(WORDS)], created_at) for id, created_at in rows[skip:skip + limit]]
+
+    def get(self, url, params, stream, timeout):
+        "Serves the same pages as JSON, like requests.get against the upstream API"
+        comments = self(params["subfeddit_id"], params["skip"], params["limit"])
+        page = [
+            {"id": c.id, "username": "user_%d" % c.id, "text": c.text, "created_at": c.created_at}
+            for c in comments
+        ]
+        return FakeResponse(json.dumps({"comments": page}).encode("utf-8"))
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), 7):
+            yield self.body[i:i + 7]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(app, "MIRROR_PAGE_SIZE", 10)
+    monkeypatch.setattr(app, "MIRROR_MAX_PAGES", 20)
+    monkeypatch.setattr(app, "MIRROR_SYNC_INTERVAL", 0)
+    monkeypatch.setattr(app, "MIRROR_UPSTREAM_ORDER", "auto")
+
+    def install(count, newest_first=True):
+        fake = FakeUpstream(count, newest_first)
+        monkeypatch.setattr(app, "fetch_comments", fake)
+        return fake
+
+    return install
+
+
+def mirrored_ids(mirror):
+    return [comment.id for comment in mirror.comments]
+
+
+def test_mirror_add_and_range():
+    "Test comments are kept in created_at order, deduplicated and bisected inclusively"
+    mirror = app.CommentMirror("1")
+    mirror.add([app.Comment(3, "c", 30), app.Comment(1, "a", 10)])
+    mirror.add([app.Comment(2, "b", 20), app.Comment(3, "c", 30), app.Comment(4, "d", 20)])
+    assert mirrored_ids(mirror) == [1, 2, 4, 3]
+    assert [c.id for c in mirror.range(20, 30)] == [2, 4, 3]
+    assert [c.id for c in mirror.range(None, 19)] == [1]
+    assert mirror.range(31, None) == []
+
+
+@pytest.mark.parametrize("newest_first", [True, False])
+def test_mirror_incremental_sync_either_order(upstream, newest_first):
+    "Test new comments arrive whichever order upstream pages in"
+    fake = upstream(25, newest_first)
+    mirror = app.CommentMirror("1")
+    assert mirror.sync()
+    assert len(mirror.comments) == 25
+    assert mirror.complete()
+    fake.add(12)
+    fake.calls.clear()
+    assert mirror.sync()
+    assert mirrored_ids(mirror) == list(range(37))
+    assert mirror.high_water == 1704453378 + 36
+    assert mirror.order == ("newest_first" if newest_first else "oldest_first")
+    assert min(fake.calls) == (0 if newest_first else 24)
+
+
+def test_mirror_oldest_first_reanchors_after_deletions(upstream):
+    "Test shifted upstream positions do not make the mirror miss new comments"
+    fake = upstream(25, newest_first=False)
+    mirror = app.CommentMirror("1")
+    mirror.sync()
+    del fake.rows[:15]
+    fake.add(3)
+    mirror.sync()
+    assert mirrored_ids(mirror)[-3:] == [25, 26, 27]
+
+
+def test_mirror_backfill_is_bounded_per_sync(upstream, monkeypatch):
+    "Test a long history is backfilled over several syncs and pages fall back meanwhile"
+    monkeypatch.setattr(app, "MIRROR_MAX_PAGES", 3)
+    fake = upstream(100)
+    mirror = app.CommentMirror("1")
+    mirror.sync()
+    assert len(fake.calls) == 3
+    assert mirrored_ids(mirror) == list(range(70, 100))
+    assert [c.id for c in mirror.page(0, 10)] == list(range(99, 89, -1))
+    assert [c.id for c in mirror.page(5, 10, 1704453378 + 88)] == [94, 93, 92, 91, 90, 89, 88]
+    assert mirror.page(25, 10) is None
+    for _ in range(4):
+        mirror.sync()
+    assert mirrored_ids(mirror) == list(range(100))
+    assert mirror.complete()
+    assert [c.id for c in mirror.page(95, 10)] == [4, 3, 2, 1, 0]
+
+
+def test_mirror_caps_comments(upstream, monkeypatch):
+    "Test the mirror drops its oldest comments beyond MIRROR_MAX_COMMENTS"
+    monkeypatch.setattr(app, "MIRROR_MAX_COMMENTS", 15)
+    upstream(25)
+    mirror = app.CommentMirror("1")
+    mirror.sync()
+    assert mirrored_ids(mirror) == list(range(10, 25))
+    assert [c.id for c in mirror.page(5, 10)] == list(range(19, 9, -1))
+    assert mirror.page(10, 10) is None
+
+
+def test_mirror_transient_error_is_not_not_found(upstream):
+    "Test an upstream error mid-sync keeps the subfeddit and falls back upstream"
+    fake = upstream(100)
+    fake.fail_at = 20
+    mirror = app.CommentMirror("1")
+    assert not mirror.sync()
+    assert mirror.exists
+    assert [c.id for c in mirror.page(0, 10)] == list(range(99, 89, -1))
+    assert mirror.page(50, 10) is None
+
+
+def test_mirror_unknown_subfeddit(monkeypatch):
+    "Test a subfeddit missing upstream is reported as not found once backfill saw it"
+    monkeypatch.setattr(app, "MIRROR_SYNC_INTERVAL", 0)
+    monkeypatch.setattr(app, "fetch_comments", lambda subfeddit_id, skip, limit: None)
+    monkeypatch.setattr(app.CommentMirror, "schedule_backfill", lambda self: None)
+    mirror = app.CommentMirror("404")
+    assert mirror.refresh()
+    mirror.backfill()
+    assert not mirror.refresh()
+
+
+def test_mirror_refresh_fetches_at_most_one_page(upstream, monkeypatch):
+    "Test requests leave cold mirrors and catching up to the background backfill"
+    scheduled = []
+    monkeypatch.setattr(app.CommentMirror, "schedule_backfill", lambda self: scheduled.append(self))
+    fake = upstream(100)
+    mirror = app.CommentMirror("1")
+    assert mirror.refresh()
+    assert fake.calls == [] and len(scheduled) == 1
+    mirror.sync()
+    fake.add(5)
+    fake.calls.clear()
+    assert mirror.refresh()
+    assert fake.calls == [0]
+    assert mirror.has_newest and mirror.high_water == 1704453378 + 104
+    fake.add(20)
+    fake.calls.clear()
+    assert mirror.refresh()
+    assert fake.calls == [0]
+    assert not mirror.has_newest
+    assert mirror.page(0, 10) is None
+    assert len(scheduled) == 2
+
+
+def test_mirror_backfill_completes_in_background(upstream, monkeypatch):
+    "Test backfill keeps syncing until the mirror holds the whole history"
+    monkeypatch.setattr(app, "MIRROR_MAX_PAGES", 3)
+    upstream(100, newest_first=False)
+    mirror = app.CommentMirror("1")
+    mirror.refresh()
+    for _ in range(100):
+        if not mirror.backfilling:
+            break
+        time.sleep(0.01)
+    assert not mirror.backfilling
+    assert mirror.complete()
+    assert mirrored_ids(mirror) == list(range(100))
+
+
+
+def test_poller_waits_for_newest_comments(upstream, monkeypatch):
+    "Test backfilled history is not published as live comments"
+    monkeypatch.setattr(app, "MIRROR_MAX_PAGES", 3)
+    monkeypatch.setattr(app, "comment_mirrors", app.OrderedDict())
+    monkeypatch.setattr(app.CommentMirror, "schedule_backfill", lambda self: self.sync())
+    fake = upstream(100, newest_first=False)
+    poller = app.SubfedditPoller("1")
+    published = []
+    for _ in range(6):
+        published += poller.poll_once()
+    assert published == []
+    assert poller.cursor == 1704453378 + 99
+    fake.add(2)
+    assert [comment.id for comment in poller.poll_once()] == [100, 101]
+
+
+
+def test_subscribe_caps_live_streams(monkeypatch):
+    "Test a worker refuses streams beyond SSE_MAX_SUBSCRIBERS until one unsubscribes"
+    monkeypatch.setattr(app, "SSE_MAX_SUBSCRIBERS", 2)
+    monkeypatch.setattr(app.SubfedditPoller, "run", lambda self: None)
+    monkeypatch.setattr(app, "sse_pollers", {})
+    monkeypatch.setattr(app, "sse_subscriber_count", 0)
+    first = app.subscribe("1")
+    second = app.subscribe("2")
+    assert app.subscribe("1") == (None, None)
+    app.unsubscribe(*first)
+    app.unsubscribe(*first)
+    assert app.sse_subscriber_count == 1
+    third = app.subscribe("1")
+    assert third[1] is not None
+    app.unsubscribe(*second)
+    app.unsubscribe(*third)
+    assert app.sse_subscriber_count == 0
+
+
+def test_profile_attachment_releases_live_stream(monkeypatch):
+    "Test replacing a stream with its profile attachment still unsubscribes"
+    monkeypatch.setattr(app.profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(app.profiling, "PROFILE_SECRET", "s3cret")
+    monkeypatch.setattr(app.SubfedditPoller, "run", lambda self: None)
+    monkeypatch.setattr(app, "sse_pollers", {})
+    monkeypatch.setattr(app, "sse_subscriber_count", 0)
+    response = app.app.test_client().get(
+        "/api/v1/subfeddit/1/comments/sentiment/stream", headers={"X-Profile": "s3cret; attach"}
+    )
+    assert response.headers["X-Profile-Status"] == "200"
+    assert "spans" in response.get_json()
+    assert app.sse_subscriber_count == 0
+
+
+@pytest.mark.parametrize("newest_first", [True, False])
+@pytest.mark.parametrize("max_pages", [3, 20])
+def test_mirrored_pages_match_upstream(upstream, monkeypatch, newest_first, max_pages):
+    "Test the mirror answers a page like upstream would, or leaves it to upstream"
+    monkeypatch.setattr(app, "MIRROR_MAX_PAGES", max_pages)
+    monkeypatch.setattr(app, "MIRROR_SYNC_INTERVAL", 60)
+    monkeypatch.setattr(app.CommentMirror, "schedule_backfill", lambda self: None)
+    monkeypatch.setattr(app, "comment_mirrors", app.OrderedDict())
+    fake = upstream(100, newest_first)
+    monkeypatch.setattr(app.requests, "get", fake.get)
+    app.get_comment_mirror("1").sync()
+    client = app.app.test_client()
+    url = "/api/v1/subfeddit/1/comments/sentiment"
+    queries = [
+        "?skip=10&limit=10&start_time=2000-01-01T00:00:00",
+        "?skip=0&limit=25&start_time=2000-01-01T00:00:00&sort=desc",
+        "?skip=40&limit=30&end_time=2100-01-01T00:00:00",
+        "?skip=95&limit=10&start_time=2000-01-01T00:00:00",
+    ]
+    for query in queries:
+        monkeypatch.setattr(app, "COMMENT_MIRROR", True)
+        fake.calls.clear()
+        mirrored = client.get(url + query).get_json()
+        assert len(fake.calls) <= 1
+        monkeypatch.setattr(app, "COMMENT_MIRROR", False)
+        assert mirrored == client.get(url + query).get_json()
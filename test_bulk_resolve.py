@@ -0,0 +1,75 @@
+import pytest
+import bulk_resolve
+
+
+def golden_ami_item(ami_id, expiry_date, base_ami_id, active=True, flavour="Golden-AMI-ABC-Cloud"):
+    return {
+        "AMIID": {"S": ami_id},
+        "ExpiryDate": {"N": str(expiry_date)},
+        "BaseAMIID": {"S": base_ami_id},
+        "AMIFlavour": {"S": flavour},
+        "Platform": {"S": "Linux/UNIX"},
+        "IMDSVersion": {"S": "v1.0"},
+        "EC2Account": {"S": "12345678901"},
+        "EC2Region": {"S": "us-east-1"},
+        "AMIActive": {"BOOL": active},
+    }
+
+
+ROW = {
+    "kr_card": "KR-12345",
+    "os_type": "Linux/UNIX",
+    "ami_flavour": "Golden-AMI-ABC-Cloud",
+    "region": "us-east-1",
+    "account_id": "12345678901",
+    "imds_ver": "v1.0",
+}
+
+
+def test_build_indexes_keeps_latest_active_ami():
+    "Test only the active ami with the highest ExpiryDate is indexed per key"
+    by_flavour, by_base_ami = bulk_resolve.build_indexes([
+        golden_ami_item("ami-old", 1704453378, "ami-base-1"),
+        golden_ami_item("ami-new", 1804453378, "ami-base-2"),
+        golden_ami_item("ami-inactive", 1904453378, "ami-base-1", active=False),
+        {"AMIID": {"S": "ami-incomplete"}},
+    ])
+    filters = ("Golden-AMI-ABC-Cloud", "Linux/UNIX", "v1.0", "12345678901", "us-east-1")
+    assert by_flavour == {filters: ("ami-new", 1804453378, "ami-base-2")}
+    assert by_base_ami[("ami-base-1",) + filters] == ("ami-old", 1704453378, "ami-base-1")
+    assert by_base_ami[("ami-base-2",) + filters] == ("ami-new", 1804453378, "ami-base-2")
+
+
+def test_resolve_row_pinned_kr_card_stays_on_base_ami():
+    "Test a pinned KR card resolves within its base ami only"
+    indexes = bulk_resolve.build_indexes([
+        golden_ami_item("ami-old", 1704453378, "ami-base-1"),
+        golden_ami_item("ami-new", 1804453378, "ami-base-2"),
+    ])
+    result = bulk_resolve.resolve_row(ROW, {"KR-12345": "ami-base-1"}, *indexes)
+    assert result["ami_id"] == "ami-old"
+    assert result["status"] == "ok"
+    result = bulk_resolve.resolve_row(ROW, {"KR-12345": "ami-base-3"}, *indexes)
+    assert result["status"] == "not_found"
+
+
+def test_resolve_row_unpinned_kr_card_resolves_by_flavour_and_pins():
+    "Test an unpinned KR card resolves by flavour and is pinned for later rows"
+    indexes = bulk_resolve.build_indexes([
+        golden_ami_item("ami-old", 1704453378, "ami-base-1"),
+        golden_ami_item("ami-new", 1804453378, "ami-base-2"),
+    ])
+    kr_cards = {}
+    result = bulk_resolve.resolve_row(ROW, kr_cards, *indexes)
+    assert result["ami_id"] == "ami-new"
+    assert kr_cards == {"KR-12345": "ami-base-2"}
+    result = bulk_resolve.resolve_row(dict(ROW, ami_flavour="Golden-AMI-ABC-IND"), kr_cards, *indexes)
+    assert result["status"] == "not_found"
+
+
+def test_missing_table_names_are_rejected(monkeypatch):
+    "Test the CLI fails fast when table names are not configured"
+    monkeypatch.delenv("GOLDEN_AMI_TABLE", raising=False)
+    monkeypatch.delenv("KR_CARD_TABLE", raising=False)
+    with pytest.raises(SystemExit):
+        bulk_resolve.main(["inventory.csv"])
@@ -1,4 +1,9 @@
 import boto3 
+import botocore
+import logging
+import pytest
+import sys
+import time
 from moto import mock_aws
 from fastapi.testclient import TestClient
 from fastapi import status
@@ -503,3 +508,345 @@ def test_retreive_ami_from_api_failure():
     assert res.status_code == 404
     assert res.json() == {'detail': 'No matching ami id found for provided parameters'}
     
+@mock_aws
+def test_retreive_ami_from_api_not_modified(): 
+    "Test the conditional GET returns 304 for a current ETag"
+    dynamodb = boto3.client('dynamodb', region_name='us-east-1') 
+    dynamodb.create_table(
+        TableName="golden-ami-table",
+        KeySchema=[
+            {
+                'AttributeName': 'AMIID',
+                'KeyType': 'HASH'
+            },
+            {
+                'AttributeName': 'ExpiryDate',
+                'KeyType': 'RANGE'
+            },
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'AMIID',
+                'AttributeType': 'S'
+            },
+            {
+                'AttributeName': 'ExpiryDate',
+                'AttributeType': 'N'
+            },
+            {
+                'AttributeName': 'AMIFlavour',
+                'AttributeType': 'S'
+            },
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'AMIFlavour-ExpiryDate-index',
+                'KeySchema': [
+                    {
+                        'AttributeName': 'AMIFlavour',
+                        'KeyType': 'HASH'
+                    },
+                    {
+                        'AttributeName': 'ExpiryDate',
+                        'KeyType': 'RANGE'
+                    },
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL',
+                },
+                'ProvisionedThroughput': {
+                    'ReadCapacityUnits': 10,
+                    'WriteCapacityUnits': 10
+                }
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 10,
+            'WriteCapacityUnits': 10
+        }
+    )
+    dynamodb.put_item(Item={
+        "AMIID":{
+            "S":"ami-of7654321f"
+        },
+        "ExpiryDate":{
+            "N":"4102444800",
+        },
+        "AMIFlavour":{
+            "S":"Golden-AMI-ABC-Cloud",
+        },
+        "Platform":{
+            "S":"Linux/UNIX",
+        },
+        "IMDSVersion":{
+            "S":"v2.0"
+        },
+        "EC2Account":{
+            "S":"12345678901"
+        },
+        "EC2Region":{
+            "S":"us-east-1"
+        },
+        "BaseAMIID":{
+            "S":"ami-123456ef"
+        },
+        "AMIActive":{
+            "BOOL":True
+        }
+    },
+    TableName="golden-ami-table",
+    )
+    dynamodb.create_table(
+        TableName="base-ami-test-table",
+        KeySchema=[
+            {
+                'AttributeName': 'KR_CARD',
+                'KeyType': 'HASH'
+            },
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'KR_CARD',
+                'AttributeType': 'S'
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 10,
+            'WriteCapacityUnits': 10
+        }
+    )
+    params = {"kr_card": "KR-246810", "os_type": "Linux/UNIX", "ami_flavour": "Golden-AMI-ABC-Cloud", "region": "us-east-1", "account_id": "12345678901", "imds_ver": "v2.0"}
+    res = client.get("/get_ami", params=params)
+    assert res.status_code == status.HTTP_200_OK
+    assert res.json() == 'ami-of7654321f'
+    assert res.headers["etag"] == retrieve_golden_ami.ami_etag('ami-of7654321f')
+    assert res.headers["cache-control"].startswith("public, max-age=")
+    res = client.get("/get_ami", params=params, headers={"If-None-Match": res.headers["etag"]})
+    assert res.status_code == status.HTTP_304_NOT_MODIFIED
+
+def test_circuit_breaker_trips_and_recovers():
+    "Test the circuit breaker opens on errors and closes after a good probe"
+    breaker = retrieve_golden_ami.CircuitBreaker("golden-ami-table")
+    for _ in range(retrieve_golden_ami.BREAKER_MIN_REQUESTS):
+        breaker.allow()
+        breaker.record(True)
+    assert breaker.state == retrieve_golden_ami.CircuitBreaker.OPEN
+    with pytest.raises(retrieve_golden_ami.CircuitOpenError):
+        breaker.allow()
+    breaker.opened_at -= retrieve_golden_ami.BREAKER_COOLDOWN
+    breaker.allow()
+    assert breaker.state == retrieve_golden_ami.CircuitBreaker.HALF_OPEN
+    with pytest.raises(retrieve_golden_ami.CircuitOpenError):
+        breaker.allow()
+    breaker.record(False)
+    assert breaker.state == retrieve_golden_ami.CircuitBreaker.CLOSED
+
+def test_in_process_cache_ttl_and_invalidation():
+    "Test the in-process cache backend expires and deletes entries"
+    cache = retrieve_golden_ami.InProcessCache(max_entries=2)
+    cache.set("kr:base-ami-test-table:KR-12345", "ami-0f123456e", 60)
+    assert cache.get("kr:base-ami-test-table:KR-12345") == "ami-0f123456e"
+    cache.delete("kr:base-ami-test-table:KR-12345")
+    assert cache.get("kr:base-ami-test-table:KR-12345") is None
+    cache.set("expired", "value", 0)
+    assert cache.get("expired") is None
+    cache.set("first", 1, 60)
+    cache.set("second", 2, 60)
+    cache.set("third", 3, 60)
+    assert cache.get("first") is None
+    assert cache.get("third") == 3
+
+def test_admission_controller_sheds_when_queue_full():
+    "Test the admission controller rejects requests beyond its queue"
+    controller = retrieve_golden_ami.AdmissionController(max_concurrency=1, max_queue=0)
+    controller.acquire(timeout=0.1)
+    with pytest.raises(retrieve_golden_ami.OverloadedError):
+        controller.acquire(timeout=0.1)
+    controller.release()
+    controller.acquire(timeout=0.1)
+    controller.release()
+    assert controller.stats == {"admitted": 2, "shed": 1}
+
+def test_sampling_filter_limits_and_bounds_windows():
+    "Test the log sampling filter rate limits per message and caps its windows"
+    sampling = retrieve_golden_ami.SamplingFilter(limit=2, interval=60, max_windows=3)
+    record = logging.LogRecord("root", logging.INFO, __file__, 1, "hot message %s", ("x",), None)
+    assert [sampling.filter(record) for _ in range(3)] == [True, True, False]
+    for i in range(10):
+        sampling.filter(logging.LogRecord("root", logging.INFO, __file__, 1, "msg %d" % i, None, None))
+    assert len(sampling.windows) <= 3
+    warning = logging.LogRecord("root", logging.WARNING, __file__, 1, "hot message %s", ("x",), None)
+    assert sampling.filter(warning)
+
+
+def test_deferred_queue_handler_snapshots_mutable_records():
+    "Test only records with immutable args are left for the listener to format"
+    handler = retrieve_golden_ami.DeferredQueueHandler(None)
+    record = logging.LogRecord("root", logging.INFO, __file__, 1, "ami %s %d", ("ami-1", 2), None)
+    assert handler.prepare(record) is record
+    payload = {"AMIID": "ami-1"}
+    record = logging.LogRecord("root", logging.INFO, __file__, 1, "response %s", (payload,), None)
+    prepared = handler.prepare(record)
+    payload["AMIID"] = "ami-2"
+    assert (prepared.msg, prepared.args) == ("response {'AMIID': 'ami-1'}", None)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("root", logging.ERROR, __file__, 1, "failed", None, sys.exc_info())
+    prepared = handler.prepare(record)
+    assert prepared.exc_info is None
+    assert "ValueError: boom" in prepared.exc_text
+    assert record.exc_info is not None
+
+
+class FakeDynamoDB:
+    "Minimal stand-in for a DynamoDB client with a fixed latency and outcome"
+
+    class meta:
+        region_name = "us-east-1"
+
+    def __init__(self, delay, result=None, error=None):
+        self.delay = delay
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def get_item(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    monkeypatch.setattr(retrieve_golden_ami, "HEDGE_DEFAULT_DELAY_MS", 20)
+    reader = retrieve_golden_ami.HedgedReader()
+    reader.enabled = True
+    return reader
+
+
+def test_hedged_read_hedge_wins(hedging):
+    "Test a slow primary read is beaten by the hedge"
+    hedging.tokens = 1
+    hedge = FakeDynamoDB(0, result={"Item": "hedge"})
+    hedging._hedge_client = lambda region: hedge
+    response = hedging.read(FakeDynamoDB(0.5, result={"Item": "primary"}), "get_item", TableName="t")
+    assert response == {"Item": "hedge"}
+    assert hedging.stats["hedges"] == 1
+    assert hedging.stats["hedge_wins"] == 1
+
+
+def test_hedged_read_budget_exhausted(hedging):
+    "Test no hedge is sent without budget and the primary answer is used"
+    hedge = FakeDynamoDB(0, result={"Item": "hedge"})
+    hedging._hedge_client = lambda region: hedge
+    response = hedging.read(FakeDynamoDB(0.1, result={"Item": "primary"}), "get_item", TableName="t")
+    assert response == {"Item": "primary"}
+    assert hedge.calls == 0
+    assert hedging.stats["budget_exhausted"] == 1
+
+
+def test_hedged_read_primary_fails_hedge_succeeds(hedging):
+    "Test a failing primary falls back to the hedge response"
+    hedging.tokens = 1
+    hedge = FakeDynamoDB(0.1, result={"Item": "hedge"})
+    hedging._hedge_client = lambda region: hedge
+    primary = FakeDynamoDB(0.05, error=RuntimeError("primary failed"))
+    response = hedging.read(primary, "get_item", TableName="t")
+    assert response == {"Item": "hedge"}
+    assert hedging.stats["hedge_wins"] == 1
+
+
+def test_hedged_reads_show_in_request_profile(hedging):
+    "Test reads on hedge pool threads are timed and sampled in the request profile"
+    hedging.tokens = 1
+    hedging._hedge_client = lambda region: FakeDynamoDB(0.05, result={"Item": "hedge"})
+    profile = retrieve_golden_ami.profiling.RequestProfile("GET /get_ami").start()
+    token = retrieve_golden_ami.profiling.current_profile.set(profile)
+    try:
+        hedging.read(FakeDynamoDB(0.2, result={"Item": "primary"}), "get_item", TableName="t")
+        # the losing primary read keeps running until it completes
+        time.sleep(0.25)
+    finally:
+        retrieve_golden_ami.profiling.current_profile.reset(token)
+        profile.stop()
+    assert set(profile.span_totals) == {"hedged.primary", "hedged.hedge"}
+    assert any("get_item" in stack for stack in profile.stacks)
+
+def test_connection_errors_are_degraded():
+    "Test unreachable endpoints count towards tripping the circuit breaker"
+    assert retrieve_golden_ami.is_degraded_error(
+        botocore.exceptions.EndpointConnectionError(endpoint_url="https://dynamodb.us-east-1.amazonaws.com")
+    )
+    assert retrieve_golden_ami.is_degraded_error(
+        botocore.exceptions.ConnectTimeoutError(endpoint_url="https://dynamodb.us-east-1.amazonaws.com")
+    )
+    assert not retrieve_golden_ami.is_degraded_error(KeyError("Item"))
+
+def test_refresher_refreshes_hot_entries_near_expiry(monkeypatch):
+    "Test refresh ahead only re-resolves hot entries close to going stale"
+    cache = retrieve_golden_ami.InProcessCache(max_entries=10)
+    hits = retrieve_golden_ami.Counter()
+    monkeypatch.setattr(retrieve_golden_ami, "ami_cache", cache)
+    monkeypatch.setattr(retrieve_golden_ami, "resolved_ami_hits", hits)
+    monkeypatch.setattr(retrieve_golden_ami, "REFRESH_TOP_N", 2)
+    refreshed = []
+    deadlines = []
+
+    def resolve(params, refresh_kr_card=False):
+        refreshed.append((params, refresh_kr_card))
+        deadlines.append(retrieve_golden_ami.request_deadline.get())
+
+    monkeypatch.setattr(retrieve_golden_ami, "resolve_and_store", resolve)
+    now = time.time()
+    entries = {
+        ("KR-1",): {"ExpiryDate": now + 10, "ResolvedAt": now},
+        ("KR-2",): {"ExpiryDate": now + 10000, "ResolvedAt": now},
+        ("KR-3",): {"ExpiryDate": now + 10, "ResolvedAt": now},
+    }
+    for params, entry in entries.items():
+        cache.set(retrieve_golden_ami.resolved_ami_cache_key(params), entry, 60)
+    hits.update({("KR-1",): 5, ("KR-2",): 4, ("KR-3",): 1})
+    refresher = retrieve_golden_ami.AMIRefresher()
+    refresher.run_once()
+    assert refreshed == [(("KR-1",), True)]
+    assert deadlines[0] is not None
+    assert dict(hits) == {("KR-1",): 2, ("KR-2",): 2}
+    assert refresher.stats == {"refreshed": 1, "failed": 0}
+
+def test_redis_cache_ttl_and_invalidation():
+    "Test the shared cache backend keeps the in-process TTL semantics"
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("redis")
+    cache = retrieve_golden_ami.RedisCache("redis://localhost:6379/0")
+    cache.client = fakeredis.FakeRedis()
+    entry = {"AMIID": "ami-of1234567f", "ExpiryDate": 4102444800}
+    cache.set("ami:KR-12345", entry, 60)
+    assert cache.get("ami:KR-12345") == entry
+    cache.delete("ami:KR-12345")
+    assert cache.get("ami:KR-12345") is None
+    cache.set("ami:KR-12345", entry, 60)
+    cache.set("ami:KR-12345", entry, 0)
+    assert cache.get("ami:KR-12345") is None
+
+def test_retry_budget_exhaustion_serves_stale(monkeypatch):
+    "Test shedding a throttled request falls back to the last known good ami"
+    cache = retrieve_golden_ami.InProcessCache(max_entries=10)
+    monkeypatch.setattr(retrieve_golden_ami, "ami_cache", cache)
+    params = ("KR-13579", "Linux/UNIX", "Golden-AMI-ABC-Cloud", "us-east-1", "12345678901", "v1.0")
+    cache.set(
+        retrieve_golden_ami.resolved_ami_cache_key(params),
+        {"AMIID": "ami-of1234567f", "ExpiryDate": 0, "ResolvedAt": 0, "ETag": '"stale"'},
+        60,
+    )
+
+    def throttled(params, refresh_kr_card=False):
+        retrieve_golden_ami.retry_backoff()
+
+    monkeypatch.setattr(retrieve_golden_ami, "resolve_and_store", throttled)
+    monkeypatch.setattr(retrieve_golden_ami, "REQUEST_DEADLINE", 1)
+    response = retrieve_golden_ami.Response()
+    assert retrieve_golden_ami.get_ami(*params, response=response, if_none_match=None) == "ami-of1234567f"
+    assert response.headers["X-AMI-Stale"] == "true"
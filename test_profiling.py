@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+
+import profiling
+
+
+def test_profile_mode_requires_the_secret(monkeypatch):
+    "Test the X-Profile header only selects requests carrying PROFILE_SECRET"
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 0)
+    assert profiling.profile_mode("attach") is None
+    monkeypatch.setattr(profiling, "PROFILE_SECRET", "s3cret")
+    assert profiling.profile_mode("attach") is None
+    assert profiling.profile_mode("wrong; attach") is None
+    assert profiling.profile_mode("s3cret") == "save"
+    assert profiling.profile_mode("s3cret; attach") == "attach"
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1)
+    assert profiling.profile_mode(None) == "save"
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", False)
+    assert profiling.profile_mode("s3cret; attach") is None
+
+
+def test_start_caps_active_profiles(monkeypatch):
+    "Test at most PROFILE_MAX_ACTIVE profiles run at once"
+    monkeypatch.setattr(profiling, "active_profiles", threading.BoundedSemaphore(1))
+    first = profiling.start("GET /a")
+    assert profiling.start("GET /b") is None
+    first.stop()
+    first.stop()
+    second = profiling.start("GET /c")
+    assert second is not None
+    second.stop()
+
+
+def test_span_samples_only_threads_inside_spans(monkeypatch):
+    "Test threads are sampled while they run spans and not the creating thread"
+    monkeypatch.setattr(profiling, "PROFILE_INTERVAL", 0.001)
+    profile = profiling.RequestProfile("GET /a").start()
+    assert not profile.threads
+    with profile.span("outer"):
+        with profile.span("inner"):
+            time.sleep(0.02)
+        assert list(profile.threads) == [threading.get_ident()]
+    assert not profile.threads
+    profile.stop()
+    assert profile.stacks
+    assert profile.span_totals["inner"][0] == 1
+
+
+def test_save_keeps_newest_profiles(monkeypatch, tmp_path):
+    "Test saved profiles beyond PROFILE_MAX_FILES are deleted oldest first"
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILE_MAX_FILES", 2)
+    paths = []
+    for i in range(4):
+        profile = profiling.RequestProfile("GET /%d" % i)
+        profile.duration = 0.0
+        paths.append(profile.save())
+        os.utime(paths[-1], (i, i))
+    profiling.prune_profiles()
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in paths[2:])
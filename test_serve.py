@@ -0,0 +1,47 @@
+import pytest
+
+import serve
+
+
+@pytest.fixture
+def launched(monkeypatch):
+    runs = []
+    monkeypatch.setattr(serve, "preload", lambda service: "application of %s" % service)
+    monkeypatch.setattr(serve.PreforkApplication, "run", lambda self: runs.append(self))
+    return runs
+
+
+def test_main_maps_options_for_the_ami_service(launched):
+    "Test the ami service runs uvicorn workers without a thread setting"
+    assert serve.main(["ami", "--workers", "3", "--bind", "127.0.0.1:9000", "--max-requests", "50"]) == 0
+    (application,) = launched
+    assert application.load() == "application of ami"
+    assert application.options["worker_class"] == "uvicorn_worker.UvicornWorker"
+    assert application.options["threads"] is None
+    assert application.cfg.workers == 3
+    assert application.cfg.bind == ["127.0.0.1:9000"]
+    assert application.cfg.max_requests == 50
+    assert application.cfg.preload_app
+
+
+def test_main_maps_options_for_the_sentiment_service(launched, monkeypatch):
+    "Test the sentiment service runs gthread workers with the requested threads"
+    import app
+
+    monkeypatch.setattr(app, "SSE_MAX_SUBSCRIBERS", 4)
+    assert serve.main(["sentiment", "--threads", "12", "--timeout", "60"]) == 0
+    (application,) = launched
+    assert application.options["worker_class"] == "gthread"
+    assert application.cfg.threads == 12
+    assert application.cfg.timeout == 60
+
+
+def test_main_rejects_threads_not_above_the_sse_cap(launched, monkeypatch):
+    "Test live streams cannot be configured to take every worker thread"
+    import app
+
+    monkeypatch.setattr(app, "SSE_MAX_SUBSCRIBERS", 8)
+    with pytest.raises(SystemExit) as exc_info:
+        serve.main(["sentiment", "--threads", "8"])
+    assert exc_info.value.code == 2
+    assert launched == []